@@ -0,0 +1,6 @@
+"""
+Helper routines shared by the notebooks of the "Introduction to Atomistic Modeling" course.
+
+The notebooks import the modules they need explicitly, e.g. ``from iam_tools.neighbors import VerletList``,
+so that nothing here is loaded unless it is used.
+"""
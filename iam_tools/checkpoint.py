@@ -0,0 +1,125 @@
+"""
+Checkpoints for long MD runs driven by ASE integrators.
+
+A checkpoint stores everything needed to continue a simulation exactly where it stopped:
+positions, momenta and cell of the atoms, the step counters and the thermostat/barostat
+settings of the integrators, the state of their random number generators, and any extra
+state of the driving loop (e.g. the index of the next segment of a temperature ramp). A run
+restarted from a checkpoint gives the same trajectory, to the last bit, as an uninterrupted one.
+
+Checkpoints are written to a temporary file that replaces the previous one only once it is
+complete, so an interrupted run always leaves a usable checkpoint behind::
+
+    save_checkpoint(path, atoms, {"npt": dyn, "langevin": lan}, segment=i)
+    ...
+    state = load_checkpoint(path, atoms, {"npt": dyn, "langevin": lan})
+    first = state["segment"]
+"""
+
+import json
+import os
+
+import numpy as np
+
+from .structures import CACHE_DIRNAME
+
+# settings of the ASE integrators that may change during a run
+_DYNAMICS_ATTRIBUTES = ["nsteps", "dt", "temp", "fr", "temperature", "pressure", "taut", "taup", "compressibility"]
+
+
+def checkpoint_path(filename):
+    """
+    Default location of the checkpoint of a run writing to filename, in the cache folder next to it.
+    """
+    folder, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(folder, CACHE_DIRNAME, name + ".checkpoint.npz")
+
+
+def _rng_state(rng):
+    if rng is np.random or isinstance(rng, np.random.RandomState):
+        name, keys, position, has_gauss, gauss = rng.get_state()
+        return {"legacy": [name, keys.tolist(), position, has_gauss, gauss]}
+    if isinstance(rng, np.random.Generator):
+        return {"generator": rng.bit_generator.state}
+    return None
+
+
+def _set_rng_state(rng, state):
+    if "legacy" in state:
+        name, keys, position, has_gauss, gauss = state["legacy"]
+        rng.set_state((name, np.asarray(keys, dtype=np.uint32), position, has_gauss, gauss))
+    else:
+        rng.bit_generator.state = state["generator"]
+
+
+def save_checkpoint(path, atoms, dynamics, **state):
+    """
+    Saves the state of a simulation.
+
+    :param path: checkpoint file (``.npz``)
+    :param atoms: the ase.Atoms object being simulated
+    :param dynamics: a dictionary {name: integrator} of the ASE integrators acting on atoms
+    :param state: other JSON-serializable values needed to restart the run
+    """
+    settings = {}
+    for name, dyn in dynamics.items():
+        settings[name] = {key: getattr(dyn, key) for key in _DYNAMICS_ATTRIBUTES if hasattr(dyn, key)}
+        rng = _rng_state(getattr(dyn, "rng", None))
+        if rng is not None:
+            settings[name]["rng"] = rng
+    header = {"dynamics": settings, "state": state, "global_rng": _rng_state(np.random)}
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            positions=atoms.positions,
+            momenta=atoms.get_momenta(),
+            cell=atoms.cell.array,
+            pbc=atoms.pbc,
+            numbers=atoms.numbers,
+            header=json.dumps(header),
+        )
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, atoms, dynamics, **expected):
+    """
+    Restores the state of a simulation saved by ``save_checkpoint``.
+
+    :param path: checkpoint file
+    :param atoms: the ase.Atoms object to restore, which must contain the same atoms
+    :param dynamics: the integrators to restore, with the same names as when saving
+    :param expected: state entries that must have the same value as in the checkpoint,
+        e.g. the parameters of the run
+
+    :return: the dictionary of extra state that was saved with the checkpoint
+    """
+    with np.load(path) as data:
+        arrays = {key: data[key] for key in data.files}
+    header = json.loads(str(arrays["header"]))
+    state = header["state"]
+    for key, value in expected.items():
+        if state.get(key) != value:
+            raise ValueError(f"The checkpoint {path} was saved with {key}={state.get(key)!r}, not {value!r}")
+    if not np.array_equal(arrays["numbers"], atoms.numbers):
+        raise ValueError(f"The checkpoint {path} contains different atoms")
+
+    atoms.set_cell(arrays["cell"])
+    atoms.pbc = arrays["pbc"]
+    atoms.positions = arrays["positions"]
+    atoms.set_momenta(arrays["momenta"])
+    for name, dyn in dynamics.items():
+        settings = dict(header["dynamics"][name])
+        rng = settings.pop("rng", None)
+        for key, value in settings.items():
+            setattr(dyn, key, value)
+        if rng is not None:
+            _set_rng_state(dyn.rng, rng)
+        # Langevin precomputes its coefficients from the temperature and friction
+        if hasattr(dyn, "updatevars"):
+            dyn.updatevars()
+    if header["global_rng"] is not None:
+        _set_rng_state(np.random, header["global_rng"])
+    return state
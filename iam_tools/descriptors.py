@@ -0,0 +1,58 @@
+"""
+An on-disk cache for the feature matrices of datasets of structures.
+
+``cached_features`` stores the feature matrix computed by any descriptor function (including
+the code typed in a ``scwidgets`` code widget) next to the dataset, keyed by the content of the
+dataset, the code of the function and its parameters, so the features are only computed again
+when one of these changes.
+"""
+
+import hashlib
+import os
+import re
+
+import numpy as np
+
+from .structures import default_cache_dir, load_structures
+from .sweep import function_key
+
+
+def _features_path(filename, descriptor, args):
+    dataset = load_structures(filename).manifest["sha256"]
+    key = hashlib.sha256(repr((dataset, function_key(descriptor), args)).encode()).hexdigest()[:24]
+    name = getattr(descriptor, "function_name", None) or getattr(descriptor, "__name__", "features")
+    return os.path.join(default_cache_dir(filename) + ".features", re.sub(r"\W", "_", name) + "-" + key)
+
+
+def cached_features(descriptor, filename, *args):
+    """
+    Feature matrix ``descriptor(structures, *args)`` for all the structures in filename,
+    loaded from disk if it has been computed before for the same dataset, code and arguments.
+
+    :param descriptor: a function that takes a list of structures (and optionally other
+        arguments) and returns a feature matrix, or a ``scwidgets`` code widget
+    :param filename: the dataset, read with ``read_cached(filename, ':')``
+    :param args: other arguments of the descriptor, e.g. the order of the polynomial
+
+    :return: the feature matrix, as a numpy array or a ``scipy.sparse`` matrix
+    """
+    from scipy.sparse import issparse, load_npz, save_npz
+
+    path = _features_path(filename, descriptor, args)
+    if os.path.exists(path + ".npz"):
+        return load_npz(path + ".npz")
+    if os.path.exists(path + ".npy"):
+        return np.load(path + ".npy")
+
+    structures = load_structures(filename)[:]
+    features = descriptor(structures, *args)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written to a temporary file first, so an interrupted write is not taken for a cached result
+    if issparse(features):
+        save_npz(path + ".tmp.npz", features.tocsr())
+        os.replace(path + ".tmp.npz", path + ".npz")
+    else:
+        features = np.asarray(features)
+        np.save(path + ".tmp.npy", features)
+        os.replace(path + ".tmp.npy", path + ".npy")
+    return features
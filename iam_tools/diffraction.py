@@ -0,0 +1,177 @@
+"""
+Powder diffraction peaks for 2D and 3D crystals.
+
+All the reciprocal lattice vectors that can be observed with a given wavelength (those with
+|G| <= 2k, inside the limiting sphere of the Ewald construction) are generated at once from
+the bounds that |G| puts on each Miller index, and the structure factors of all of them
+are obtained from a single complex matrix product,
+
+    F(G) = sum_j f_j exp(-i G.s_j).
+
+The set of reflections depends only on the lattice, so it is cached: changing the wavelength
+(as long as it does not get shorter) or the basis and form factors only recomputes the angles
+and the structure factors.
+"""
+
+import itertools
+
+import numpy as np
+
+from .sweep import SweepCache
+
+# the sets of reflections of the recently used lattices, also used by the notebooks to
+# keep the reciprocal lattice vectors they enumerate
+reflection_cache = SweepCache(maxsize=32)
+
+
+def reflections(reciprocal, g_max):
+    """
+    Reciprocal lattice vectors with modulus up to g_max, including G=0.
+
+    :param reciprocal: (d, d) array with the reciprocal lattice vectors as rows (d=2 or 3)
+    :param g_max: largest modulus of the vectors that are returned
+
+    :return: (indices, G, modulus), with the integer (Miller) indices, the Cartesian G vectors
+        and their length, ordered as nested loops over the indices
+    """
+    reciprocal = np.asarray(reciprocal, dtype=float)
+    if not np.all(np.isfinite(reciprocal)):
+        raise ValueError("The reciprocal lattice vectors must be finite")
+    key = (reciprocal.shape, reciprocal.tobytes())
+    cached = reflection_cache.get(key)
+    if cached is None or cached[0] < g_max:
+        # G = n @ B, so |n_i| <= |G| |B^-1 e_i|; degenerate (zero) lattice vectors get no indices
+        bounds = np.floor(g_max * np.linalg.norm(np.linalg.pinv(reciprocal), axis=0) * (1 + 1e-12))
+        ranges = [np.arange(-n, n + 1) for n in bounds.astype(int)]
+        indices = np.stack(np.meshgrid(*ranges, indexing="ij"), axis=-1).reshape(-1, len(ranges))
+        vectors = indices @ reciprocal
+        modulus = np.linalg.norm(vectors, axis=1)
+        inside = modulus <= g_max
+        cached = (g_max, indices[inside], vectors[inside], modulus[inside])
+        reflection_cache.put(key, cached)
+    _, indices, vectors, modulus = cached
+    inside = modulus <= g_max
+    return indices[inside], vectors[inside], modulus[inside]
+
+
+def structure_factors(vectors, positions, form_factors):
+    """
+    Structure factors F(G) = sum_j f_j exp(-i G.s_j) for many G vectors at once.
+
+    :param vectors: (n, d) array of reciprocal lattice vectors
+    :param positions: (N, d) array with the Cartesian positions of the basis atoms
+    :param form_factors: atomic form factors, array of length N
+
+    :return: complex array of length n
+    """
+    phases = np.asarray(vectors) @ np.asarray(positions, dtype=float).T
+    return np.exp(-1j * phases) @ np.asarray(form_factors, dtype=float)
+
+
+def diffraction_peaks(reciprocal, positions, form_factors, wavelength):
+    """
+    All the reflections that can be observed with a given wavelength, one per G vector.
+
+    :param reciprocal: (d, d) array with the reciprocal lattice vectors as rows
+    :param positions: (N, d) Cartesian positions of the basis atoms
+    :param form_factors: atomic form factors of the basis atoms
+    :param wavelength: wavelength of the radiation
+
+    :return: (indices, theta, intensity), with theta half of the scattering angle,
+        and intensity = |F(G)|^2
+    """
+    k = 2 * np.pi / wavelength
+    indices, vectors, modulus = reflections(reciprocal, 2 * k)
+    theta = np.arcsin(np.minimum(modulus / (2 * k), 1.0))
+    intensity = np.abs(structure_factors(vectors, positions, form_factors)) ** 2
+    return indices, theta, intensity
+
+
+def symmetry_operations(reciprocal, positions, form_factors, tolerance=1e-5):
+    """
+    Point group of a crystal, as the integer matrices W acting on the fractional coordinates
+    (x -> W x + t) that map the lattice onto itself, and the basis onto itself for some
+    translation t. The lattice operations are searched among the matrices with entries
+    -1, 0 and 1, which contain all of them for a reduced cell.
+
+    :param tolerance: largest difference in fractional coordinates, and in the metric relative
+        to its largest entry, for two positions or metrics to be considered equal
+
+    :return: (m, d, d) integer array, always including the identity
+    """
+    reciprocal = np.asarray(reciprocal, dtype=float)
+    d = len(reciprocal)
+    if np.linalg.matrix_rank(reciprocal) < d:
+        return np.eye(d, dtype=int)[np.newaxis]
+    cell = 2 * np.pi * np.linalg.inv(reciprocal).T
+    metric = cell @ cell.T
+    candidates = np.array(list(itertools.product((-1, 0, 1), repeat=d * d))).reshape(-1, d, d)
+    transformed = np.einsum("mji,jk,mkl->mil", candidates, metric, candidates)
+    lattice = candidates[np.all(np.abs(transformed - metric) <= tolerance * np.abs(metric).max(), axis=(1, 2))]
+
+    fractional = np.asarray(positions, dtype=float) @ reciprocal.T / (2 * np.pi)
+    form_factors = np.asarray(form_factors, dtype=float)
+
+    def maps_basis(W):
+        moved = fractional @ W.T
+        for k in np.flatnonzero(form_factors == form_factors[0]):
+            delta = fractional[:, np.newaxis] - (moved + fractional[k] - moved[0])
+            same = np.all(np.abs(delta - np.round(delta)) <= tolerance, axis=-1)
+            same &= form_factors[:, np.newaxis] == form_factors
+            if np.all(same.any(axis=0)):
+                return True
+        return False
+
+    return lattice[[maps_basis(W) for W in lattice]]
+
+
+def powder_peaks(reciprocal, positions, form_factors, wavelength, tolerance=1e-5):
+    """
+    Powder diffraction peaks, merging the reflections that are equivalent by symmetry.
+
+    Reflections are merged when they are related by an operation of the point group of the
+    crystal (see ``symmetry_operations``), or by G -> -G, which have the same intensity by
+    Friedel's law. Reflections that only happen to have the same |G| and intensity are kept
+    as separate peaks. The G=0 (forward scattering) term is left out.
+
+    :param tolerance: see ``symmetry_operations``
+
+    :return: (indices, theta, intensity, multiplicity), sorted by angle, with one representative
+        set of indices for each peak, and the intensity summed over the equivalent reflections
+    """
+    indices, theta, intensity = diffraction_peaks(reciprocal, positions, form_factors, wavelength)
+    keep = theta > 0
+    indices, theta, intensity = indices[keep], theta[keep], intensity[keep]
+
+    # the reflections equivalent to h are h W for all the operations W, and their opposites:
+    # all the members of an orbit share the largest of them, e.g. (2,1,0) rather than (-1,0,-2)
+    operations = symmetry_operations(reciprocal, positions, form_factors, tolerance)
+    operations = np.concatenate([operations, -operations])
+    # indices are compared through a code that orders them lexicographically, and the codes
+    # of all the h W are obtained from a single product, as h W w = h (W w)
+    n_max = np.abs(indices).max(initial=0)
+    weights = (2 * n_max + 1) ** np.arange(indices.shape[1])[::-1]
+    codes = indices @ (operations @ weights).T
+    largest = codes.argmax(axis=1)
+
+    _, first, group = np.unique(codes[np.arange(len(codes)), largest], return_index=True, return_inverse=True)
+    group = group.ravel()
+    by_angle = np.argsort(theta[first], kind="stable")
+    rank = np.empty(len(first), dtype=int)
+    rank[by_angle] = np.arange(len(first))
+    representative = np.einsum("ni,nij->nj", indices[first], operations[largest[first]])
+    return (
+        representative[by_angle],
+        theta[first][by_angle],
+        np.bincount(rank[group], intensity, minlength=len(first)),
+        np.bincount(rank[group], minlength=len(first)),
+    )
+
+
+def powder_pattern(structure, wavelength, tolerance=1e-5):
+    """
+    Powder diffraction peaks of a periodic ``ase.Atoms`` structure (e.g. from ``data/crystals.xyz``),
+    using the atomic numbers as form factors. See ``powder_peaks``.
+    """
+    reciprocal = 2 * np.pi * structure.cell.reciprocal()
+    return powder_peaks(reciprocal, structure.positions, structure.numbers, wavelength, tolerance=tolerance)
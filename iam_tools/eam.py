@@ -0,0 +1,205 @@
+"""
+Fast embedded-atom method calculator for potentials in the LAMMPS ``setfl`` (``.eam.alloy``) format.
+
+``ase.calculators.eam.EAM`` evaluates a scipy spline object per atom and per neighbor species,
+in a Python loop over atoms. Here the splines are converted once into tables of cubic
+coefficients on the uniform grids of the potential file, and energies, forces and stress
+are evaluated for all the pairs at once, by looking up the coefficients of each distance
+(and each density) in the tables. The splines are the same as those used by ASE (interpolating
+cubic splines with not-a-knot end conditions), so results agree to rounding error.
+"""
+
+import numpy as np
+from ase.calculators.calculator import Calculator, all_changes
+from ase.stress import full_3x3_to_voigt_6_stress
+
+from .neighbors import VerletList
+
+
+class UniformSpline:
+    """
+    Cubic spline interpolating values tabulated on a uniform grid, stored as a table
+    of polynomial coefficients that can be evaluated on arrays of points. Points outside
+    the grid are extrapolated with the first or last polynomial.
+    """
+
+    def __init__(self, x0, dx, values):
+        """
+        :param x0: first grid point
+        :param dx: grid spacing
+        :param values: values of the function on the grid points
+        """
+        from scipy.interpolate import CubicSpline
+
+        values = np.asarray(values, dtype=float)
+        self.x0, self.dx = x0, dx
+        grid = x0 + dx * np.arange(len(values))
+        # (n_intervals, 4) coefficients, from the highest power down
+        self.coefficients = np.ascontiguousarray(CubicSpline(grid, values).c.T)
+
+    def _locate(self, x):
+        interval = np.floor((x - self.x0) / self.dx).astype(int)
+        interval = np.clip(interval, 0, len(self.coefficients) - 1)
+        return self.coefficients[interval], x - (self.x0 + interval * self.dx)
+
+    def __call__(self, x):
+        c, s = self._locate(np.asarray(x, dtype=float))
+        return ((c[..., 0] * s + c[..., 1]) * s + c[..., 2]) * s + c[..., 3]
+
+    def value_and_derivative(self, x):
+        c, s = self._locate(np.asarray(x, dtype=float))
+        value = ((c[..., 0] * s + c[..., 1]) * s + c[..., 2]) * s + c[..., 3]
+        derivative = (3 * c[..., 0] * s + 2 * c[..., 1]) * s + c[..., 2]
+        return value, derivative
+
+
+def read_setfl(filename):
+    """
+    Reads an EAM potential in the setfl (``.eam.alloy``) format.
+
+    :return: a dictionary with the element symbols, their atomic numbers and masses,
+        the grids (nrho, drho, nr, dr), the cutoff, and the tabulated functions:
+        ``embedding[i]``, ``density[i]`` and ``rphi[i][j]`` (r times the pair potential)
+    """
+    with open(filename) as f:
+        lines = f.readlines()
+    header = lines[3].split()
+    n_elements, elements = int(header[0]), header[1:]
+    nrho, drho, nr, dr, cutoff = lines[4].split()[:5]
+    nrho, drho, nr, dr, cutoff = int(nrho), float(drho), int(nr), float(dr), float(cutoff)
+
+    # the rest of the file is a stream of numbers, with a 4-field header line per element
+    tokens = " ".join(lines[5:]).split()
+    position = 0
+
+    def take(n):
+        nonlocal position
+        block = np.array(tokens[position:position + n], dtype=float)
+        position += n
+        return block
+
+    numbers, masses, embedding, density = [], [], [], []
+    for _ in range(n_elements):
+        numbers.append(int(tokens[position]))
+        masses.append(float(tokens[position + 1]))
+        position += 4
+        embedding.append(take(nrho))
+        density.append(take(nr))
+    rphi = [[None] * n_elements for _ in range(n_elements)]
+    for i in range(n_elements):
+        for j in range(i + 1):
+            rphi[i][j] = rphi[j][i] = take(nr)
+
+    return {
+        "elements": elements,
+        "numbers": numbers,
+        "masses": masses,
+        "nrho": nrho,
+        "drho": drho,
+        "nr": nr,
+        "dr": dr,
+        "cutoff": cutoff,
+        "embedding": embedding,
+        "density": density,
+        "rphi": rphi,
+    }
+
+
+class EAM(Calculator):
+    """
+    Drop-in replacement for ``ase.calculators.eam.EAM`` for setfl potentials, e.g.
+    ``EAM(potential='data/Al99.eam.alloy')``. Computes energy, per-atom energies, forces and stress.
+    The neighbor list is kept between calls, see ``VerletList``, and is available as ``calc.neighbors``.
+    """
+
+    implemented_properties = ["energy", "free_energy", "energies", "forces", "stress"]
+
+    def __init__(self, potential, skin=0.3, **kwargs):
+        """
+        :param potential: path of a setfl (``.eam.alloy``) potential file
+        :param skin: extra distance included in the neighbor list
+        """
+        Calculator.__init__(self, **kwargs)
+        self.potential = potential
+        data = read_setfl(potential)
+        self.elements = data["elements"]
+        self.cutoff = data["cutoff"]
+        self.embedding = [UniformSpline(0.0, data["drho"], f) for f in data["embedding"]]
+        self.density = [UniformSpline(0.0, data["dr"], f) for f in data["density"]]
+        # as in ase, the pair potential is splined without the r=0 point, where r*phi vanishes
+        r = data["dr"] * np.arange(data["nr"])
+        self.phi = [
+            [UniformSpline(r[1], data["dr"], rphi[1:] / r[1:]) for rphi in row] for row in data["rphi"]
+        ]
+        self.neighbors = VerletList(self.cutoff, skin=skin)
+
+    def _species(self, atoms):
+        symbols = atoms.get_chemical_symbols()
+        missing = set(symbols) - set(self.elements)
+        if missing:
+            raise ValueError(f"Elements {sorted(missing)} are not described by {self.potential}")
+        index = {symbol: k for k, symbol in enumerate(self.elements)}
+        return np.array([index[s] for s in symbols], dtype=int)
+
+    def neighbor_pairs(self, atoms):
+        """
+        Half neighbor list within the cutoff of the potential, as (i, j, vectors, distances).
+        """
+        i, j, shifts, distances = self.neighbors.update(atoms)
+        vectors = atoms.positions[j] - atoms.positions[i] + shifts @ atoms.cell.array
+        return i, j, vectors, distances
+
+    def calculate(self, atoms=None, properties=["energy"], system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+        atoms = self.atoms
+        n_atoms = len(atoms)
+        species = self._species(atoms)
+        i, j, vectors, r = self.neighbor_pairs(atoms)
+        n_species = len(self.elements)
+
+        # electron density on each atom, and the derivative of the pair contributions
+        rho = np.zeros(n_atoms)
+        drho_i = np.zeros(len(r))  # d rho_i / d r_ij, from the density of atom j
+        drho_j = np.zeros(len(r))  # d rho_j / d r_ij, from the density of atom i
+        for a in range(n_species):
+            on_j, on_i = species[j] == a, species[i] == a
+            if on_j.any():
+                value, derivative = self.density[a].value_and_derivative(r[on_j])
+                rho += np.bincount(i[on_j], value, minlength=n_atoms)
+                drho_i[on_j] = derivative
+            if on_i.any():
+                value, derivative = self.density[a].value_and_derivative(r[on_i])
+                rho += np.bincount(j[on_i], value, minlength=n_atoms)
+                drho_j[on_i] = derivative
+
+        energies = np.zeros(n_atoms)
+        dF = np.zeros(n_atoms)
+        for a in range(n_species):
+            mine = species == a
+            energies[mine], dF[mine] = self.embedding[a].value_and_derivative(rho[mine])
+
+        dphi = np.zeros(len(r))
+        for a in range(n_species):
+            for b in range(a, n_species):
+                pair = ((species[i] == a) & (species[j] == b)) | ((species[i] == b) & (species[j] == a))
+                if pair.any():
+                    value, dphi[pair] = self.phi[a][b].value_and_derivative(r[pair])
+                    energies += 0.5 * np.bincount(i[pair], value, minlength=n_atoms)
+                    energies += 0.5 * np.bincount(j[pair], value, minlength=n_atoms)
+
+        energy = energies.sum()
+        self.results["energy"] = self.results["free_energy"] = energy
+        self.results["energies"] = energies
+
+        # dE/dr_ij for each pair, and the corresponding forces along the pair vector
+        scale = dphi + dF[i] * drho_i + dF[j] * drho_j
+        pair_forces = (scale / r)[:, np.newaxis] * vectors
+        forces = np.zeros((n_atoms, 3))
+        for k in range(3):
+            forces[:, k] = np.bincount(i, pair_forces[:, k], minlength=n_atoms)
+            forces[:, k] -= np.bincount(j, pair_forces[:, k], minlength=n_atoms)
+        self.results["forces"] = forces
+
+        if atoms.cell.rank == 3:
+            stress = pair_forces.T @ vectors / atoms.get_volume()
+            self.results["stress"] = full_3x3_to_voigt_6_stress(stress)
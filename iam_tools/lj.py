@@ -0,0 +1,92 @@
+"""
+Lennard-Jones calculator that reuses its neighbor list between steps.
+
+``ase.calculators.lj.LennardJones`` updates an ASE neighbor list and loops over atoms at every
+force call. This version keeps a ``VerletList`` with a skin, so that during MD or a geometry
+optimization the pairs are searched again only once the atoms have moved by a sizable amount,
+and evaluates all the pairs at once. The parameters and the results are the same as for ASE.
+"""
+
+import numpy as np
+from ase.calculators.calculator import Calculator, all_changes
+from ase.calculators.lj import cutoff_function, d_cutoff_function
+from ase.stress import full_3x3_to_voigt_6_stress
+
+from .neighbors import VerletList
+
+
+class LennardJones(Calculator):
+    """
+    Drop-in replacement for ``ase.calculators.lj.LennardJones``, e.g.
+    ``LennardJones(sigma=2.62, epsilon=0.41, rc=2*2.62)``. The neighbor list manager
+    is available as ``calc.neighbors``, and reports how often the list is rebuilt.
+    """
+
+    implemented_properties = ["energy", "energies", "forces", "free_energy", "stress", "stresses"]
+    default_parameters = {"epsilon": 1.0, "sigma": 1.0, "rc": None, "ro": None, "smooth": False, "skin": 0.3}
+    nolabel = True
+
+    def __init__(self, **kwargs):
+        """
+        :param sigma: the potential minimum is at 2**(1/6) * sigma
+        :param epsilon: depth of the potential
+        :param rc: cutoff, 3 * sigma if None. The energy is shifted to be zero at rc
+        :param ro: onset of the cutoff function in smooth mode, 0.66 * rc if None
+        :param smooth: if True the pair energy is multiplied by a cutoff function
+            that goes smoothly to zero between ro and rc, rather than being shifted
+        :param skin: extra distance included in the neighbor list, see ``VerletList``
+        """
+        Calculator.__init__(self, **kwargs)
+        if self.parameters.rc is None:
+            self.parameters.rc = 3 * self.parameters.sigma
+        if self.parameters.ro is None:
+            self.parameters.ro = 0.66 * self.parameters.rc
+        self.neighbors = VerletList(self.parameters.rc, skin=self.parameters.skin)
+
+    def calculate(self, atoms=None, properties=None, system_changes=all_changes):
+        if properties is None:
+            properties = self.implemented_properties
+        Calculator.calculate(self, atoms, properties, system_changes)
+        atoms = self.atoms
+        n_atoms = len(atoms)
+        sigma, epsilon = self.parameters.sigma, self.parameters.epsilon
+        rc, ro = self.parameters.rc, self.parameters.ro
+
+        i, j, shifts, r = self.neighbors.update(atoms)
+        vectors = atoms.positions[j] - atoms.positions[i] + shifts @ atoms.cell.array
+        r2 = r**2
+        c6 = (sigma**2 / r2) ** 3
+        c12 = c6**2
+        pair_energies = 4 * epsilon * (c12 - c6)
+        pair_forces = -24 * epsilon * (2 * c12 - c6) / r2  # derivative of the energy divided by r
+        if self.parameters.smooth:
+            cutoff_fn = cutoff_function(r2, rc**2, ro**2)
+            pair_forces = cutoff_fn * pair_forces + 2 * d_cutoff_function(r2, rc**2, ro**2) * pair_energies
+            pair_energies *= cutoff_fn
+        else:
+            pair_energies -= 4 * epsilon * ((sigma / rc) ** 12 - (sigma / rc) ** 6)
+
+        # each pair is listed once: half of the energy goes to each atom
+        energies = 0.5 * (
+            np.bincount(i, pair_energies, minlength=n_atoms) + np.bincount(j, pair_energies, minlength=n_atoms)
+        )
+        pair_forces = pair_forces[:, np.newaxis] * vectors
+        forces = np.zeros((n_atoms, 3))
+        for k in range(3):
+            forces[:, k] = np.bincount(i, pair_forces[:, k], minlength=n_atoms)
+            forces[:, k] -= np.bincount(j, pair_forces[:, k], minlength=n_atoms)
+
+        if atoms.cell.rank == 3:
+            volume = atoms.get_volume()
+            pair_stress = full_3x3_to_voigt_6_stress(pair_forces[:, :, np.newaxis] * vectors[:, np.newaxis, :])
+            stresses = 0.5 * (
+                np.array([np.bincount(i, s, minlength=n_atoms) for s in pair_stress.T]).T
+                + np.array([np.bincount(j, s, minlength=n_atoms) for s in pair_stress.T]).T
+            )
+            self.results["stress"] = stresses.sum(axis=0) / volume
+            self.results["stresses"] = stresses / volume
+
+        energy = energies.sum()
+        self.results["energy"] = self.results["free_energy"] = energy
+        self.results["energies"] = energies
+        self.results["forces"] = forces
@@ -0,0 +1,188 @@
+"""
+Mean-square displacement and diffusion coefficients from MD trajectories.
+
+The MSD as a function of the time lag, averaged over all time origins, is computed with the
+FFT autocorrelation trick, which costs O(T log T) rather than O(T^2) for T frames.
+"""
+
+import os
+
+import numpy as np
+
+from .sweep import function_key
+
+
+def unwrap_positions(positions, cells=None):
+    """
+    Removes the jumps due to atoms being wrapped back into the periodic cell, assuming that
+    no atom moves by more than half a cell between consecutive frames.
+
+    :param positions: (T, N, 3) array of positions
+    :param cells: (3, 3) cell, or (T, 3, 3) array of cells. If None, positions are returned unchanged
+
+    :return: (T, N, 3) array of unwrapped positions
+    """
+    positions = np.asarray(positions, dtype=float)
+    if cells is None:
+        return positions
+    cells = np.broadcast_to(np.asarray(cells, dtype=float), (len(positions), 3, 3))
+    steps = np.diff(positions, axis=0)
+    fractional = np.einsum("tnk,tkl->tnl", steps, np.linalg.inv(cells[1:]))
+    steps -= np.einsum("tnk,tkl->tnl", np.round(fractional), cells[1:])
+    return np.concatenate([positions[:1], positions[:1] + np.cumsum(steps, axis=0)])
+
+
+def _autocorrelation(x):
+    # sum over the last axis of the autocorrelation of x along the first axis, for all lags
+    n_frames = len(x)
+    size = 2 ** int(np.ceil(np.log2(2 * n_frames)))
+    transform = np.fft.rfft(x, n=size, axis=0)
+    power = (transform * transform.conj()).real
+    correlation = np.fft.irfft(power, axis=0)[:n_frames]
+    return correlation.reshape(n_frames, -1).sum(axis=1) / (n_frames - np.arange(n_frames))
+
+
+def msd_fft(positions):
+    """
+    Mean-square displacement, averaged over atoms and over all time origins.
+
+    :param positions: (T, N, 3) array of unwrapped positions, equally spaced in time
+
+    :return: an array of T values, msd[k] being the MSD for a lag of k frames
+    """
+    positions = np.asarray(positions, dtype=float)
+    n_frames, n_atoms = positions.shape[:2]
+    squares = np.sum(positions**2, axis=(1, 2))
+    # sum of |r(t+k)|^2 + |r(t)|^2 over the T-k time origins, for all lags k
+    head = np.concatenate([[0.0], np.cumsum(squares)[:-1]])
+    tail = np.concatenate([[0.0], np.cumsum(squares[::-1])[:-1]])
+    s1 = (2 * squares.sum() - head - tail) / (n_frames - np.arange(n_frames))
+    return (s1 - 2 * _autocorrelation(positions)) / n_atoms
+
+
+def fit_diffusion(times, msd, fit_range=(0.2, 0.8), dimensions=3):
+    """
+    Fits the Einstein relation MSD = 2 d D t + c to the MSD curve.
+
+    :param times: time lags
+    :param msd: MSD values
+    :param fit_range: fraction of the lags over which the linear fit is performed. Short lags
+        are in the ballistic regime, and long lags are averaged over few time origins
+    :param dimensions: number of dimensions d
+
+    :return: the diffusion coefficient D and the intercept c
+    """
+    times, msd = np.asarray(times), np.asarray(msd)
+    start, stop = (int(f * len(times)) for f in fit_range)
+    stop = max(stop, start + 2)
+    slope, intercept = np.polyfit(times[start:stop], msd[start:stop], 1)
+    return slope / (2 * dimensions), intercept
+
+
+def trajectory_msd(frames, time_step=1.0):
+    """
+    MSD curve for a list of ase.Atoms frames, unwrapping the positions with the cell of each frame.
+
+    :param frames: a sequence of ase.Atoms, equally spaced in time
+    :param time_step: time between consecutive frames
+
+    :return: (lags, msd), two arrays of length len(frames)
+    """
+    positions = np.array([frame.positions for frame in frames])
+    cells = None
+    if frames[0].pbc.any():
+        cells = np.array([frame.cell.array for frame in frames])
+    msd = msd_fft(unwrap_positions(positions, cells))
+    return time_step * np.arange(len(msd)), msd
+
+
+class FileResultCache:
+    """
+    Caches the result of a function of a file name, recomputing it only if the file has changed
+    (by size or modification time) or if a different function is used. Functions are compared
+    by their code, so re-running a notebook cell with the same definition keeps the cache, and
+    the code widgets of ``scwidgets`` by the code that was typed in them.
+    """
+
+    def __init__(self):
+        self._results = {}
+
+    def __call__(self, function, filename, *args):
+        """
+        Returns ``function(filename, *args)``, from the cache if possible.
+        """
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), args)
+        stamp = (stat.st_size, stat.st_mtime_ns, function_key(function))
+        cached = self._results.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        result = function(filename, *args)
+        self._results[key] = (stamp, result)
+        return result
+
+    def clear(self):
+        self._results.clear()
+
+
+def file_msd(filename, time_step=1.0, index=":"):
+    """
+    MSD curve of a trajectory file. Use with a ``FileResultCache`` to avoid recomputing it.
+
+    :param filename: trajectory file that can be read by ase
+    :param time_step: time between consecutive frames
+    :param index: which frames to use, e.g. ``"1:"`` to skip the first one
+
+    :return: (lags, msd)
+    """
+    from ase.io import read
+
+    return trajectory_msd(read(filename, index), time_step)
+
+
+def _uniform_step(times):
+    """Spacing of a sequence of equally spaced times, or a ValueError if it isn't uniform."""
+    steps = np.diff(times)
+    if len(steps) == 0:
+        raise ValueError("at least two frames are needed to find the time step")
+    if not np.allclose(steps, steps[0], rtol=1e-6, atol=0):
+        raise ValueError(
+            f"frames are not equally spaced in time (steps between {steps.min():g} and "
+            f"{steps.max():g} ps): pass time_step explicitly if the times are not reliable"
+        )
+    return steps[0]
+
+
+def file_diffusion(filename, window=25, key="target_temperature", time_step=None):
+    """
+    Diffusion coefficients in consecutive windows of a trajectory file, e.g. to follow melting
+    along a temperature ramp. Frames are read one at a time, and must be equally spaced in time.
+    Use with a ``FileResultCache`` to avoid recomputing them.
+
+    :param filename: trajectory file in the extxyz format
+    :param window: number of frames in each window
+    :param key: ``info`` entry that is averaged over each window, and returned with the coefficients
+    :param time_step: time between consecutive frames in ps. By default it is taken from the
+        ``time`` entry of the frames' ``info``, which must then be present in every frame
+
+    :return: (mean of info[key] over each window, diffusion coefficients in Å²/ps)
+    """
+    from .trajectory import TrajectoryReader
+
+    positions, cells, times, values = [], [], [], []
+    for frame in TrajectoryReader(filename):
+        positions.append(frame.positions)
+        cells.append(frame.cell.array)
+        if time_step is None:
+            times.append(frame.info["time"])
+        values.append(frame.info[key])
+    positions = unwrap_positions(np.array(positions), np.array(cells))
+    if time_step is None:
+        time_step = _uniform_step(times)
+
+    means, coefficients = [], []
+    for start in range(0, len(positions) - window + 1, window):
+        msd = msd_fft(positions[start : start + window])
+        coefficients.append(fit_diffusion(time_step * np.arange(window), msd)[0])
+        means.append(np.mean(values[start : start + window]))
+    return np.array(means), np.array(coefficients)
@@ -0,0 +1,254 @@
+"""
+Linked-cell neighbor lists for periodic (orthorhombic or triclinic) and open boundary conditions.
+
+The atoms are sorted into bins whose heights are at least as large as the cutoff, so that
+neighbors can only be found in the adjacent bins. All the loops run over the (few) bin offsets
+rather than over atoms, so the cost scales linearly with the number of atoms.
+"""
+
+import itertools
+
+import numpy as np
+
+
+def _cell_heights(cell):
+    # distance between opposite faces of the cell, along each lattice vector
+    volume = np.abs(np.linalg.det(cell))
+    return np.array(
+        [volume / np.linalg.norm(np.cross(cell[(k + 1) % 3], cell[(k + 2) % 3])) for k in range(3)]
+    )
+
+
+def cell_list_pairs(positions, cell, pbc, cutoff, half=False):
+    """
+    Finds all the pairs of atoms closer than cutoff, including periodic images.
+
+    The convention is the same as ``ase.neighborlist.neighbor_list``: the distance vector
+    of a pair is ``positions[j] - positions[i] + shifts @ cell``.
+
+    :param positions: (N, 3) array of Cartesian coordinates
+    :param cell: (3, 3) array with the cell vectors as rows
+    :param pbc: periodic boundary conditions, a bool or three bools
+    :param cutoff: cutoff distance
+    :param half: if True, each pair is returned only once, otherwise both (i, j) and (j, i) are listed
+
+    :return: (i, j, shifts, distances), with i and j integer arrays of atom indices,
+        shifts a (n_pairs, 3) integer array of cell shifts and distances the pair distances
+    """
+    positions = np.asarray(positions, dtype=float)
+    cell = np.asarray(cell, dtype=float)
+    pbc = np.broadcast_to(np.asarray(pbc, dtype=bool), (3,))
+    n_atoms = len(positions)
+    empty = np.zeros(0, dtype=int)
+    if n_atoms == 0:
+        return empty, empty, np.zeros((0, 3), dtype=int), np.zeros(0)
+
+    # open directions may come with a degenerate cell: replace it with a box enclosing the atoms
+    if not pbc.all():
+        lengths = np.linalg.norm(cell, axis=1)
+        span = positions.max(axis=0) - positions.min(axis=0) + cutoff
+        for k in np.where(~pbc)[0]:
+            if lengths[k] < 1e-8:
+                cell = cell.copy()
+                cell[k] = 0.0
+                cell[k, k] = span[k]
+        if np.abs(np.linalg.det(cell)) < 1e-12:
+            raise ValueError("Cannot build a neighbor list for a degenerate periodic cell")
+
+    fractional = np.linalg.solve(cell.T, positions.T).T
+    # wraps atoms into the cell along periodic directions, keeping track of the lattice translation
+    wrap = np.zeros((n_atoms, 3), dtype=int)
+    wrap[:, pbc] = -np.floor(fractional[:, pbc]).astype(int)
+    fractional = fractional + wrap
+    wrapped = fractional @ cell
+
+    heights = _cell_heights(cell)
+    origin = np.where(pbc, 0.0, fractional.min(axis=0))
+    extent = np.where(pbc, 1.0, np.maximum(fractional.max(axis=0) - origin, 1e-12))
+    n_bins = np.maximum(1, np.floor(heights * extent / cutoff).astype(int))
+    # along open directions there are no images; along periodic ones a small cell
+    # needs to be searched over several images
+    reach = np.where(pbc, np.ceil(cutoff * n_bins / heights).astype(int), 1)
+
+    bin_index = np.floor((fractional - origin) / extent * n_bins).astype(int)
+    bin_index = np.minimum(np.maximum(bin_index, 0), n_bins - 1)
+    bin_id = np.ravel_multi_index(bin_index.T, n_bins)
+    order = np.argsort(bin_id, kind="stable")
+    bin_count = np.bincount(bin_id, minlength=np.prod(n_bins))
+    bin_start = np.concatenate([[0], np.cumsum(bin_count)[:-1]])
+
+    atom_i, atom_j, all_shifts, all_distances = [], [], [], []
+    offsets = itertools.product(*[range(-r, r + 1) for r in reach])
+    for offset in offsets:
+        target = bin_index + offset
+        shift = np.floor_divide(target, n_bins)
+        valid = np.all((shift == 0) | pbc, axis=1)
+        target = target - shift * n_bins
+        i = np.where(valid)[0]
+        target_id = np.ravel_multi_index(target[i].T, n_bins)
+        counts = bin_count[target_id]
+        i = np.repeat(i, counts)
+        if len(i) == 0:
+            continue
+        # position of each candidate inside its bin
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(bin_start[target_id], counts) + np.arange(len(i)) - first]
+        shift = shift[i]
+
+        delta = wrapped[j] - wrapped[i] + shift @ cell
+        distance = np.sqrt(np.sum(delta**2, axis=1))
+        keep = distance < cutoff
+        keep &= ~((i == j) & np.all(shift == 0, axis=1))
+        atom_i.append(i[keep])
+        atom_j.append(j[keep])
+        all_shifts.append(shift[keep] + wrap[j[keep]] - wrap[i[keep]])
+        all_distances.append(distance[keep])
+
+    if not atom_i:
+        return empty, empty, np.zeros((0, 3), dtype=int), np.zeros(0)
+    i = np.concatenate(atom_i)
+    j = np.concatenate(atom_j)
+    shifts = np.concatenate(all_shifts)
+    distances = np.concatenate(all_distances)
+
+    if half:
+        # keeps i < j, and for self-images only one of the two opposite shifts
+        first_nonzero = np.argmax(shifts != 0, axis=1)
+        positive = shifts[np.arange(len(shifts)), first_nonzero] > 0
+        keep = (i < j) | ((i == j) & positive)
+        i, j, shifts, distances = i[keep], j[keep], shifts[keep], distances[keep]
+
+    # a canonical order, that does not depend on the binning: the forces summed over the pairs
+    # are then the same to the last bit whether or not the list was built from scratch
+    sort = np.lexsort((shifts[:, 2], shifts[:, 1], shifts[:, 0], j, i))
+    return i[sort], j[sort], shifts[sort], distances[sort]
+
+
+def neighbor_list(structure, cutoff, half=False):
+    """
+    Linked-cell neighbor list for an ``ase.Atoms`` object, see ``cell_list_pairs``.
+
+    :param structure: an ase.Atoms object
+    :param cutoff: cutoff distance
+    :param half: if True, each pair is returned only once
+
+    :return: (i, j, shifts, distances)
+    """
+    return cell_list_pairs(
+        structure.positions, structure.cell.array, structure.pbc, cutoff, half=half
+    )
+
+
+class VerletList:
+    """
+    Neighbor list with a skin, that is rebuilt only when the atoms have moved enough that
+    pairs closer than the cutoff might be missing from it.
+
+    The list contains all pairs within ``cutoff + skin``. Between rebuilds, a pair can get closer
+    by at most twice the largest displacement of an atom, so the list stays valid as long as no
+    atom moved by more than half the skin. Changes of the cell (e.g. from a barostat that rescales
+    atoms with the cell) are accounted for by measuring displacements after undoing the cell
+    deformation, and by the largest contraction of distances that the deformation can cause.
+    Atoms that are wrapped back into the cell do not trigger a rebuild.
+    """
+
+    def __init__(self, cutoff, skin=0.3, half=True):
+        """
+        :param cutoff: cutoff distance of the pairs that are returned
+        :param skin: extra distance included in the list
+        :param half: if True, each pair is returned only once
+        """
+        self.cutoff = cutoff
+        self.skin = skin
+        self.half = half
+        self.n_calls = 0
+        self.n_builds = 0
+        self._reference = None
+
+    @property
+    def rebuild_rate(self):
+        """
+        Fraction of the calls that required building a new list.
+        """
+        return self.n_builds / max(self.n_calls, 1)
+
+    def summary(self):
+        return (
+            f"neighbor list rebuilt {self.n_builds} times in {self.n_calls} calls "
+            f"({100 * self.rebuild_rate:.1f}%, skin {self.skin:.2f} Å)"
+        )
+
+    def _build(self, positions, cell, pbc, numbers):
+        i, j, shifts, _ = cell_list_pairs(positions, cell, pbc, self.cutoff + self.skin, half=self.half)
+        periodic = pbc.all() or np.abs(np.linalg.det(cell)) > 1e-12
+        self._reference = {
+            "i": i,
+            "j": j,
+            "shifts": shifts,
+            "positions": positions.copy(),
+            "cell": cell.copy(),
+            "pbc": pbc.copy(),
+            "numbers": numbers.copy(),
+            "fractional": np.linalg.solve(cell.T, positions.T).T if periodic else None,
+        }
+        self.n_builds += 1
+
+    def _displacements(self, positions, cell):
+        # displacements in the reference cell, and the lattice translations of atoms wrapped since
+        ref = self._reference
+        if ref["fractional"] is None:
+            return positions - ref["positions"], np.zeros((len(positions), 3), dtype=int), 1.0
+        fractional = np.linalg.solve(cell.T, positions.T).T
+        jumps = np.zeros((len(positions), 3), dtype=int)
+        jumps[:, ref["pbc"]] = np.round(fractional - ref["fractional"])[:, ref["pbc"]]
+        displacements = (fractional - jumps - ref["fractional"]) @ ref["cell"]
+        # smallest factor by which the deformation from the reference cell can shrink a distance
+        deformation = np.linalg.solve(ref["cell"], cell)
+        contraction = np.linalg.svd(deformation, compute_uv=False).min()
+        return displacements, jumps, contraction
+
+    def get(self, positions, cell, pbc, numbers=None):
+        """
+        :param positions: (N, 3) array of Cartesian coordinates
+        :param cell: (3, 3) array with the cell vectors as rows
+        :param pbc: periodic boundary conditions
+        :param numbers: atomic numbers (or any per-atom labels); a change triggers a rebuild
+
+        :return: (i, j, shifts, distances) for all the pairs closer than the cutoff,
+            as in ``cell_list_pairs``
+        """
+        positions = np.asarray(positions, dtype=float)
+        cell = np.asarray(cell, dtype=float)
+        pbc = np.broadcast_to(np.asarray(pbc, dtype=bool), (3,))
+        numbers = np.zeros(len(positions), dtype=int) if numbers is None else np.asarray(numbers)
+        self.n_calls += 1
+
+        ref = self._reference
+        rebuild = (
+            ref is None
+            or len(positions) != len(ref["positions"])
+            or np.any(pbc != ref["pbc"])
+            or np.any(numbers != ref["numbers"])
+        )
+        if not rebuild:
+            displacements, jumps, contraction = self._displacements(positions, cell)
+            max_displacement = np.sqrt(np.max(np.sum(displacements**2, axis=1), initial=0.0))
+            # a pair now within the cutoff was within cutoff/contraction in the reference cell
+            rebuild = 2 * max_displacement + self.cutoff * (1 / contraction - 1) > self.skin
+        if rebuild:
+            self._build(positions, cell, pbc, numbers)
+            ref = self._reference
+            jumps = np.zeros((len(positions), 3), dtype=int)
+
+        i, j = ref["i"], ref["j"]
+        shifts = ref["shifts"] - jumps[j] + jumps[i]
+        delta = positions[j] - positions[i] + shifts @ cell
+        distances = np.sqrt(np.sum(delta**2, axis=1))
+        keep = distances < self.cutoff
+        return i[keep], j[keep], shifts[keep], distances[keep]
+
+    def update(self, structure):
+        """
+        Neighbor pairs for an ``ase.Atoms`` object, see ``get``.
+        """
+        return self.get(structure.positions, structure.cell.array, structure.pbc, structure.numbers)
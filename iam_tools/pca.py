@@ -0,0 +1,152 @@
+"""
+Principal component analysis of datasets that do not fit in memory.
+
+The features are computed in batches of structures, and each batch only updates the mean and
+the (n_features, n_features) scatter matrix of the data, merged with the pairwise update of
+Chan et al. The principal axes are the eigenvectors of the covariance, which is the same result
+as ``sklearn.decomposition.PCA`` on the whole feature matrix, but with a memory footprint that
+depends on the number of features and on the batch size, not on the number of structures.
+The latent coordinates of all the structures are written batch by batch to a memory-mapped
+``.npy`` file::
+
+    latent, itrain = streaming_pca("data/mp_elastic.extxyz", descriptor, f_train=0.5)
+"""
+
+import os
+
+import numpy as np
+
+from .structures import default_cache_dir, load_structures
+
+
+def feature_batches(structures, descriptor, *args, batch_size=1000, start=0, stop=None):
+    """
+    Generator over the feature matrices of consecutive batches of structures.
+
+    :param structures: a list of ase.Atoms, or a ``StructureCache``, which only builds the
+        structures of the current batch
+    :param descriptor: a function that takes a list of structures (and the other args) and
+        returns their feature matrix, dense or sparse
+    :param batch_size: number of structures in each batch
+    :param start, stop: range of structures to go through (default: all of them)
+    """
+    stop = len(structures) if stop is None else stop
+    for first in range(start, stop, batch_size):
+        yield descriptor(structures[first:min(first + batch_size, stop)], *args)
+
+
+class StreamingPCA:
+    """
+    PCA fitted one batch of samples at a time, with ``partial_fit`` or ``fit(batches)``.
+    """
+
+    def __init__(self, n_components=4):
+        """
+        :param n_components: dimension of the latent space
+        """
+        self.n_components = n_components
+        self.n_samples = 0
+        self.mean = None
+        self.scatter = None
+        self._axes = None
+
+    def partial_fit(self, X):
+        """
+        Adds a batch of samples, as a (n, n_features) dense or scipy.sparse matrix.
+        """
+        n = X.shape[0]
+        if n == 0:
+            return self
+        mean = np.asarray(X.mean(axis=0)).ravel()
+        if hasattr(X, "toarray"):
+            # X^T X stays sparse until it is reduced to the small (n_features, n_features) matrix
+            gram = X.T @ X
+            scatter = (gram.toarray() if hasattr(gram, "toarray") else np.asarray(gram)) - n * np.outer(mean, mean)
+        else:
+            centered = np.asarray(X, dtype=float) - mean
+            scatter = centered.T @ centered
+        if self.n_samples == 0:
+            self.mean, self.scatter = mean, scatter
+        else:
+            total = self.n_samples + n
+            delta = mean - self.mean
+            self.scatter += scatter + np.outer(delta, delta) * (self.n_samples * n / total)
+            self.mean += delta * (n / total)
+        self.n_samples += n
+        self._axes = None
+        return self
+
+    def fit(self, batches):
+        """
+        :param batches: an iterable over feature matrices, e.g. from ``feature_batches``
+        """
+        for X in batches:
+            self.partial_fit(X)
+        return self
+
+    def _eigen(self):
+        if self.n_samples < 2:
+            raise ValueError("At least two samples are needed to compute the principal components")
+        if self._axes is None:
+            variance, axes = np.linalg.eigh(self.scatter / (self.n_samples - 1))
+            order = np.argsort(variance)[::-1][: self.n_components]
+            axes = axes[:, order]
+            # the sign of each axis is arbitrary: make the largest entry positive
+            axes *= np.sign(axes[np.argmax(np.abs(axes), axis=0), np.arange(axes.shape[1])])
+            self._axes = (variance[order], axes)
+        return self._axes
+
+    @property
+    def explained_variance(self):
+        return self._eigen()[0]
+
+    @property
+    def components(self):
+        """
+        (n_components, n_features) principal axes, as in ``sklearn.decomposition.PCA.components_``
+        """
+        return self._eigen()[1].T
+
+    def transform(self, X):
+        """
+        :return: (n, n_components) latent-space coordinates of the samples in X
+        """
+        return np.asarray(X @ self._eigen()[1]) - self.mean @ self._eigen()[1]
+
+
+def streaming_pca(filename, descriptor, *args, n_components=4, f_train=1.0, batch_size=1000, out=None):
+    """
+    PCA of all the structures in a dataset, computing their features one batch at a time.
+
+    The principal axes are fitted on the first ``len(structures) * f_train`` structures, and
+    a second pass writes the latent coordinates of all the structures to a ``.npy`` file.
+
+    :param filename: the dataset, read through the structure cache (``load_structures``), which
+        converts it one structure at a time
+    :param descriptor: the fingerprint function, called as ``descriptor(batch, *args)``
+    :param n_components: dimension of the latent space
+    :param f_train: the fraction of the structures used to fit the principal axes
+    :param batch_size: number of structures whose features are in memory at the same time
+    :param out: where to write the latent coordinates (default: in the cache folder of filename)
+
+    :return: the (n_structures, n_components) latent coordinates as a read-only memory map,
+        and the range of indices of the train structures
+    """
+    structures = load_structures(filename)
+    ntrain = int(len(structures) * f_train)
+    pca = StreamingPCA(n_components)
+    pca.fit(feature_batches(structures, descriptor, *args, batch_size=batch_size, stop=ntrain))
+
+    out = out or default_cache_dir(filename) + ".pca.npy"
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    # written to a temporary file first, so maps of the results of a previous call stay valid
+    tmp = out + ".tmp.npy"
+    latent = np.lib.format.open_memmap(tmp, mode="w+", dtype=float, shape=(len(structures), n_components))
+    first = 0
+    for X in feature_batches(structures, descriptor, *args, batch_size=batch_size):
+        latent[first:first + X.shape[0]] = pca.transform(X)
+        first += X.shape[0]
+    latent.flush()
+    del latent
+    os.replace(tmp, out)
+    return np.load(out, mmap_mode="r"), range(ntrain)
@@ -0,0 +1,180 @@
+"""
+Phonon dispersion of 3D crystals from real-space force constants.
+
+The force constants are obtained by finite displacements of the atoms in one unit cell of a
+supercell, with any ASE calculator (e.g. ``iam_tools.eam.EAM``). They are stored as one
+(3 n_basis) x (3 n_basis) block for each lattice vector R in which they are nonzero, so that
+the dynamical matrices
+
+    D_ab(q) = sum_R Phi_ab(R) exp(i q.R) / sqrt(m_a m_b)
+
+of a whole batch of q-points are a single matrix product between the phase factors and the
+blocks, and their eigenvalues are computed with a single stacked ``eigh``. Band structures along
+high-symmetry paths and frequencies on Monkhorst-Pack grids use the k-point tools of ASE.
+"""
+
+import itertools
+
+import numpy as np
+from ase import units
+
+
+class ForceConstants:
+    """
+    Real-space force constants of a crystal, and the phonon frequencies they give.
+
+    Build them with ``ForceConstants.from_finite_displacements(atoms, supercell=4)``, then call
+    ``frequencies(q)`` for arbitrary wavevectors, ``band_structure()`` for a high-symmetry path,
+    or ``mesh((n, n, n))`` for a Monkhorst-Pack grid. Frequencies are in THz, and imaginary
+    frequencies are returned as negative numbers.
+    """
+
+    def __init__(self, cell, masses, lattice_points, blocks):
+        """
+        :param cell: the unit cell, as an ase ``Cell`` or a (3, 3) array with the lattice vectors as rows
+        :param masses: masses of the atoms in the unit cell, in amu
+        :param lattice_points: (n_R, 3) integer coordinates of the lattice vectors R
+        :param blocks: (n_R, 3 n_basis, 3 n_basis) force constants for each R, in eV/Å²
+        """
+        from ase.cell import Cell
+
+        self.cell = Cell.new(cell)
+        self.masses = np.asarray(masses, dtype=float)
+        self.lattice_points = np.asarray(lattice_points, dtype=int)
+        self.blocks = np.asarray(blocks, dtype=float)
+        self._vectors = self.lattice_points @ self.cell.array
+        inv_sqrt_mass = np.repeat(self.masses, 3) ** -0.5
+        self._mass_weights = np.outer(inv_sqrt_mass, inv_sqrt_mass)
+
+    @classmethod
+    def from_finite_displacements(cls, atoms, supercell=4, delta=0.01, calculator=None):
+        """
+        Computes the force constants by central finite differences of the forces, displacing
+        each atom of the unit cell in a supercell.
+
+        Force constants between atoms that are farther apart than half the supercell are
+        shared equally between the equivalent periodic images, and the acoustic sum rule is
+        imposed, so that the acoustic branches go to zero at Gamma.
+
+        :param atoms: the unit cell (ase.Atoms), at its equilibrium geometry
+        :param supercell: number of repetitions of the cell, an integer or one per lattice vector
+        :param delta: displacement, in Å
+        :param calculator: the ASE calculator for the forces (defaults to ``atoms.calc``)
+
+        :return: a ForceConstants object
+        """
+        n_cells = np.broadcast_to(np.asarray(supercell, dtype=int), (3,))
+        calculator = atoms.calc if calculator is None else calculator
+        cell = atoms.cell.array
+        n_basis = len(atoms)
+        structure = atoms.repeat(tuple(n_cells))
+        structure.calc = calculator
+        reference = structure.positions.copy()
+        # cell of each atom of the supercell, and the corresponding atom in the unit cell
+        basis = np.tile(np.arange(n_basis), int(np.prod(n_cells)))
+        offsets = reference - atoms.positions[basis]
+        cells = np.rint(np.linalg.solve(cell.T, offsets.T).T).astype(int)
+
+        # raw[a, k, j, l]: minus the derivative of the force on j along l by a displacement of a along k
+        raw = np.zeros((n_basis, 3, len(structure), 3))
+        for a, k in itertools.product(range(n_basis), range(3)):
+            forces = []
+            for sign in (1, -1):
+                positions = reference.copy()
+                positions[a, k] += sign * delta
+                structure.positions = positions
+                forces.append(structure.get_forces())
+            raw[a, k] = -(forces[0] - forces[1]) / (2 * delta)
+        structure.positions = reference
+
+        # maps each pair to the shortest lattice vector (or vectors, in case of a tie) between the atoms
+        images = np.array(list(itertools.product((-1, 0, 1), repeat=3))) * n_cells
+        blocks = {}
+        for a in range(n_basis):
+            candidates = cells[:, np.newaxis, :] + images[np.newaxis, :, :]
+            separation = candidates @ cell + atoms.positions[basis][:, np.newaxis, :] - atoms.positions[a]
+            distance = np.linalg.norm(separation, axis=2)
+            nearest = distance <= distance.min(axis=1, keepdims=True) + 1e-5
+            weights = 1.0 / nearest.sum(axis=1)
+            for j, image in zip(*np.nonzero(nearest)):
+                key = tuple(candidates[j, image])
+                if key not in blocks:
+                    blocks[key] = np.zeros((3 * n_basis, 3 * n_basis))
+                b = basis[j]
+                blocks[key][3 * a:3 * a + 3, 3 * b:3 * b + 3] += weights[j] * raw[a, :, j, :]
+
+        lattice_points = np.array(list(blocks))
+        blocks = np.array(list(blocks.values()))
+        # acoustic sum rule: a rigid translation of the crystal gives no forces
+        origin = np.flatnonzero(np.all(lattice_points == 0, axis=1))[0]
+        total = blocks.sum(axis=0).reshape(n_basis, 3, n_basis, 3).sum(axis=2)
+        for a in range(n_basis):
+            blocks[origin, 3 * a:3 * a + 3, 3 * a:3 * a + 3] -= total[a]
+        return cls(atoms.cell, atoms.get_masses(), lattice_points, blocks)
+
+    def dynamical_matrices(self, q):
+        """
+        :param q: (n_q, 3) array of wavevectors, in Cartesian coordinates (1/Å, including 2π)
+
+        :return: (n_q, 3 n_basis, 3 n_basis) array of Hermitian dynamical matrices, in eV/(Å² amu)
+        """
+        q = np.atleast_2d(q)
+        phases = np.exp(1j * (q @ self._vectors.T))
+        # the sum over R for all the q-points is one matrix product
+        matrices = (phases @ self.blocks.reshape(len(self.blocks), -1)).reshape((len(q),) + self.blocks.shape[1:])
+        matrices *= self._mass_weights
+        return 0.5 * (matrices + np.conj(np.swapaxes(matrices, 1, 2)))
+
+    def frequencies(self, q, eigenvectors=False):
+        """
+        Phonon frequencies for a batch of wavevectors.
+
+        :param q: (n_q, 3) array of wavevectors, in Cartesian coordinates (1/Å, including 2π)
+        :param eigenvectors: whether to also return the polarization vectors
+
+        :return: (n_q, 3 n_basis) array of frequencies in THz, in ascending order for each q,
+            and the (n_q, 3 n_basis, 3 n_basis) eigenvectors (as columns) if requested
+        """
+        matrices = self.dynamical_matrices(q)
+        if eigenvectors:
+            omega2, vectors = np.linalg.eigh(matrices)
+        else:
+            omega2 = np.linalg.eigvalsh(matrices)
+        # eV/(Å² amu) to (rad/s)², and then to cycles per picosecond
+        omega = np.sign(omega2) * np.sqrt(np.abs(omega2) * units._e / units._amu) * 1e10
+        frequencies = omega / (2 * np.pi * 1e12)
+        return (frequencies, vectors) if eigenvectors else frequencies
+
+    def cartesian(self, kpts):
+        """
+        Converts wavevectors in units of the reciprocal lattice vectors to Cartesian coordinates.
+        """
+        return 2 * np.pi * np.asarray(kpts) @ self.cell.reciprocal().array
+
+    def band_structure(self, path=None, npoints=200):
+        """
+        Phonon branches along a path through the high-symmetry points of the Brillouin zone.
+
+        :param path: a string of special points, e.g. ``'GXWKGLUWLK,UX'``; if None, the
+            default path for the lattice, as chosen by ASE
+        :param npoints: number of q-points along the path
+
+        :return: (x, special_x, labels, frequencies): the position of each q-point along the path,
+            the positions and names of the special points, and the (npoints, 3 n_basis) frequencies
+        """
+        bandpath = self.cell.bandpath(path, npoints=npoints)
+        x, special_x, labels = bandpath.get_linear_kpoint_axis()
+        return x, special_x, labels, self.frequencies(self.cartesian(bandpath.kpts))
+
+    def mesh(self, size):
+        """
+        Frequencies on a Monkhorst-Pack grid, e.g. to compute the density of states.
+
+        :param size: number of q-points along each reciprocal lattice vector, e.g. (20, 20, 20)
+
+        :return: (q, frequencies), with the Cartesian q-points and the (n_q, 3 n_basis) frequencies
+        """
+        from ase.dft.kpoints import monkhorst_pack
+
+        q = self.cartesian(monkhorst_pack(size))
+        return q, self.frequencies(q)
@@ -0,0 +1,173 @@
+"""
+Artist-reuse plotting for slider-driven widgets.
+
+The ``update`` callbacks of the notebooks usually call ``ax.plot`` every time a slider moves,
+so each event rebuilds all the artists and re-renders the whole figure. A ``LivePlot`` creates
+each line or scatter artist once, identified by a key, and later calls only update its data.
+With an interactive backend (``%matplotlib widget``) the updated artists are redrawn by blitting
+them over a cached background. With a static backend (e.g. inline) the figure is drawn as usual.
+
+The ``scwidgets`` exercises clear their figure before each update, and redraw all of it after:
+pass the figure as ``outputs=live_figure(fig)`` so that the axes of the live plots are left
+alone, and only their artists are redrawn::
+
+    fig, ax = plt.subplots()
+    plot = LivePlot(ax)
+    demo = CodeExercise(outputs=live_figure(fig), update=update, ...)
+"""
+
+import functools
+import weakref
+
+import matplotlib
+import numpy as np
+
+_STATIC_BACKENDS = {"agg", "pdf", "ps", "svg", "cairo", "module://matplotlib_inline.backend_inline"}
+# the live plots, whose axes live_figure does not clear
+_LIVE_PLOTS = weakref.WeakSet()
+
+
+@functools.lru_cache(maxsize=None)
+def _live_cue_figure():
+    from scwidgets import CueFigure
+
+    class LiveCueFigure(CueFigure):
+        def _live_plots(self):
+            return {plot.ax: plot for plot in _LIVE_PLOTS if plot.figure is self.figure}
+
+        def clear_figure(self):
+            live = self._live_plots()
+            for ax in self.figure.get_axes():
+                if ax not in live and (ax.has_data() or len(ax.artists) > 0):
+                    ax.clear()
+
+        def draw_display(self):
+            # when all the axes are live plots, only their artists are redrawn
+            live = self._live_plots()
+            plots = [live.get(ax) for ax in self.figure.get_axes()]
+            if plots and all(plot is not None and plot.interactive for plot in plots):
+                for plot in plots:
+                    plot.redraw()
+            else:
+                super().draw_display()
+
+    return LiveCueFigure
+
+
+def live_figure(figure, **kwargs):
+    """
+    Wraps a figure for the ``outputs`` of a ``scwidgets`` exercise. Before each update the
+    exercise clears the axes of the figure, except those of a ``LivePlot``, whose artists are
+    kept so that only their data has to change. After the update, a figure whose axes are all
+    live plots is redrawn with ``LivePlot.redraw``, rather than in full.
+
+    :param figure: a matplotlib figure
+    :param kwargs: other arguments of ``scwidgets.CueFigure``
+    """
+    return _live_cue_figure()(figure, **kwargs)
+
+
+class LivePlot:
+    """
+    Keeps the artists drawn on one axes, and updates them in place.
+
+    The widgets of ``scwidgets`` clear every axes that contains data before calling the
+    update function, unless the figure is given to them through ``live_figure``. If the
+    axes are cleared anyway, the artists are simply created again.
+    """
+
+    def __init__(self, ax):
+        """
+        :param ax: a matplotlib axes
+        """
+        self.ax = ax
+        self.figure = ax.figure
+        self._artists = {}
+        self._background = None
+        self._view = None
+        _LIVE_PLOTS.add(self)
+        self.interactive = (
+            self.figure.canvas.supports_blit
+            and matplotlib.get_backend().lower() not in _STATIC_BACKENDS
+        )
+        if self.interactive:
+            self.figure.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def _get(self, key):
+        artist = self._artists.get(key)
+        if artist is not None and artist.axes is self.ax:
+            return artist
+        return None
+
+    def _add(self, key, artist):
+        # animated artists are skipped by a full draw, and drawn on top of the background
+        artist.set_animated(self.interactive)
+        self._artists[key] = artist
+        return artist
+
+    def line(self, key, x, y, *fmt, **kwargs):
+        """
+        Draws a line, or updates the data of the line with the same key.
+        Style arguments are only used when the line is created.
+
+        :param key: any hashable identifying the line
+        :param x, y: the data, as for ``ax.plot``
+        :param fmt, kwargs: format string and keyword arguments for ``ax.plot``
+
+        :return: the Line2D artist
+        """
+        artist = self._get(key)
+        if artist is None:
+            return self._add(key, self.ax.plot(x, y, *fmt, **kwargs)[0])
+        artist.set_data(x, y)
+        return artist
+
+    def scatter(self, key, x, y, **kwargs):
+        """
+        Draws a scatter plot, or moves the points of the one with the same key.
+
+        :return: the PathCollection artist
+        """
+        artist = self._get(key)
+        if artist is None:
+            return self._add(key, self.ax.scatter(x, y, **kwargs))
+        artist.set_offsets(np.column_stack([x, y]))
+        return artist
+
+    def autoscale(self):
+        """
+        Rescales the axes to the current data of the artists, which ``set_data`` does not do.
+        """
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
+
+    def _on_draw(self, event):
+        canvas = self.figure.canvas
+        self._background = canvas.copy_from_bbox(self.ax.bbox)
+        self._view = self._view_state()
+        for artist in self._artists.values():
+            if artist.axes is self.ax:
+                self.ax.draw_artist(artist)
+
+    def _view_state(self):
+        # anything outside of the live artists that a callback may change, and that blitting
+        # would not show
+        ax = self.ax
+        return (ax.get_xlim(), ax.get_ylim(), ax.bbox.bounds, ax.get_xlabel(), ax.get_ylabel(), ax.get_title())
+
+    def redraw(self):
+        """
+        Redraws the figure. If only the artists have changed, they are blitted over the cached
+        background; if the limits, labels or title have changed (or with a static backend) the
+        full figure is redrawn.
+        """
+        canvas = self.figure.canvas
+        if not self.interactive or self._background is None or self._view_state() != self._view:
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self._background)
+        for artist in self._artists.values():
+            if artist.axes is self.ax:
+                self.ax.draw_artist(artist)
+        canvas.blit(self.ax.bbox)
+        canvas.flush_events()
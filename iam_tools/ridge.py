@@ -0,0 +1,117 @@
+"""
+Ridge regression for a whole range of regularization strengths from a single SVD.
+
+With the singular value decomposition of the (centered) train features, X = U S V^T, the ridge
+weights for any regularization alpha are
+
+    w(alpha) = V diag(s / (s^2 + alpha)) U^T y,
+
+so that changing alpha only rescales a vector of length rank(X). The same decomposition gives
+the diagonal of the hat matrix, H = U diag(s^2 / (s^2 + alpha)) U^T, and with it the
+leave-one-out (LOO) and generalized cross-validation (GCV) errors, which estimate the test
+error using only the train set. The regularization follows ``sklearn.linear_model.Ridge``:
+the loss is |y - X w - b|^2 + alpha |w|^2, and the intercept b is not regularized.
+"""
+
+import numpy as np
+
+
+class RidgePath:
+    """
+    Ridge regression model that is fitted once, and evaluated for any number of alphas.
+
+    Methods that take ``alphas`` accept a scalar or an array, and return one column per alpha.
+    """
+
+    def __init__(self, X, y, fit_intercept=True, penalty_weights=None):
+        """
+        :param X: (n_train, n_features) train feature matrix (dense or scipy.sparse)
+        :param y: (n_train,) train targets
+        :param fit_intercept: whether to fit an (unregularized) constant term
+        :param penalty_weights: optional per-feature weights p, so that the regularization
+            is alpha * sum_k (p_k w_k)^2
+        """
+        if hasattr(X, "toarray"):
+            X = X.toarray()
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.fit_intercept = fit_intercept
+        self.penalty_weights = (
+            np.ones(X.shape[1]) if penalty_weights is None else np.asarray(penalty_weights, dtype=float)
+        )
+        self.x_mean = X.mean(axis=0) if fit_intercept else np.zeros(X.shape[1])
+        self.y_mean = y.mean() if fit_intercept else 0.0
+        Z = (X - self.x_mean) / self.penalty_weights
+        U, s, Vt = np.linalg.svd(Z, full_matrices=False)
+        keep = s > s.max(initial=0.0) * max(Z.shape) * np.finfo(float).eps
+        self.U, self.s, self.Vt = U[:, keep], s[keep], Vt[keep]
+        self.y_centered = y - self.y_mean
+        self.Uty = self.U.T @ self.y_centered
+        self.n_train = len(y)
+
+    @staticmethod
+    def _alphas(alphas):
+        return np.atleast_1d(np.asarray(alphas, dtype=float))
+
+    def _filter(self, alphas, power):
+        # s^power / (s^2 + alpha), as (n_alphas, rank)
+        s = self.s[np.newaxis, :]
+        return s**power / (s**2 + self._alphas(alphas)[:, np.newaxis])
+
+    def coefficients(self, alphas):
+        """
+        :return: (weights, intercepts), with weights as a (n_features, n_alphas) array
+        """
+        weights = self.Vt.T @ (self._filter(alphas, 1) * self.Uty).T
+        weights /= self.penalty_weights[:, np.newaxis]
+        return weights, self.y_mean - self.x_mean @ weights
+
+    def predict(self, X, alphas):
+        """
+        :param X: (n, n_features) feature matrix
+
+        :return: (n, n_alphas) predictions
+        """
+        if hasattr(X, "toarray"):
+            X = X.toarray()
+        projected = ((np.asarray(X, dtype=float) - self.x_mean) / self.penalty_weights) @ self.Vt.T
+        return projected @ (self._filter(alphas, 1) * self.Uty).T + self.y_mean
+
+    def _hat(self, alphas):
+        # shrinkage factors s^2 / (s^2 + alpha) of the hat matrix, as (n_alphas, rank)
+        return self._filter(alphas, 2)
+
+    def train_residuals(self, alphas):
+        """
+        :return: (n_train, n_alphas) residuals y - y_pred on the train set
+        """
+        return self.y_centered[:, np.newaxis] - self.U @ (self._hat(alphas) * self.Uty).T
+
+    def loo_residuals(self, alphas):
+        """
+        Leave-one-out residuals, i.e. the error on each train point of a model fitted on all the
+        others, obtained as r_i / (1 - H_ii) without refitting.
+
+        :return: (n_train, n_alphas) array
+        """
+        leverage = (self.U**2) @ self._hat(alphas).T
+        if self.fit_intercept:
+            leverage += 1.0 / self.n_train
+        return self.train_residuals(alphas) / (1 - leverage)
+
+    def loo_error(self, alphas):
+        """
+        :return: leave-one-out mean squared error for each alpha
+        """
+        return np.mean(self.loo_residuals(alphas) ** 2, axis=0)
+
+    def gcv_error(self, alphas):
+        """
+        Generalized cross-validation error, mean(r^2) / (1 - tr(H) / n)^2, a rotation-invariant
+        approximation of the leave-one-out error.
+
+        :return: the GCV error for each alpha
+        """
+        dof = self._hat(alphas).sum(axis=1) + (1 if self.fit_intercept else 0)
+        mse = np.mean(self.train_residuals(alphas) ** 2, axis=0)
+        return mse / (1 - dof / self.n_train) ** 2
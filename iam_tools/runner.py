@@ -0,0 +1,159 @@
+"""
+Runs a simulation function for several parameter values (e.g. temperatures) in parallel.
+
+Each run executes in its own process, with the numpy and Python random generators seeded from
+an independent stream that depends only on the seed and on the parameter value, so a run
+gives the same result regardless of which other values are in the sweep. A small manifest is
+stored next to each output file; outputs produced by the same function code and seed are
+considered up to date, and are not recomputed.
+
+The function is sent to the workers as source code, so it must be self-contained (import what
+it needs in its body), as the exercise functions in the notebooks are.
+"""
+
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import textwrap
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from .structures import CACHE_DIRNAME
+from .sweep import function_key
+
+
+def _function_source(function):
+    # scwidgets code widgets keep the code typed by the student
+    source = getattr(function, "full_function_code", None)
+    if source is not None:
+        return source, function.function_name
+    return textwrap.dedent(inspect.getsource(function)), function.__name__
+
+
+def _seed_state(seed, value):
+    # an independent stream for each value, that does not depend on the other values in the sweep
+    tag = int.from_bytes(hashlib.sha256(repr(value).encode()).digest()[:8], "little")
+    return np.random.SeedSequence(seed, spawn_key=(tag,)).generate_state(4)
+
+
+def _manifest_path(filename):
+    folder, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(folder, CACHE_DIRNAME, name + ".run.json")
+
+
+def _stamp(filename):
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_up_to_date(filename, key, value, seed):
+    """
+    Whether filename exists and was produced by a run with the same function, value and seed.
+    """
+    path = _manifest_path(filename)
+    if not (os.path.exists(filename) and os.path.exists(path)):
+        return False
+    with open(path) as f:
+        manifest = json.load(f)
+    expected = {"function": key, "value": repr(value), "seed": seed, **_stamp(filename)}
+    return all(manifest.get(k) == v for k, v in expected.items())
+
+
+def _record(filename, key, value, seed):
+    path = _manifest_path(filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"function": key, "value": repr(value), "seed": seed, **_stamp(filename)}, f)
+
+
+def _run(source, name, value, state, log_path):
+    import random
+    from contextlib import redirect_stderr, redirect_stdout
+
+    np.random.seed(state)
+    random.seed(int(state[0]))
+    namespace = {"__name__": "__iam_runner__"}
+    exec(compile(source, f"<{name}>", "exec"), namespace)
+    # progress bars and prints of the workers go to a log file rather than to the notebook
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, "w") as log, redirect_stdout(log), redirect_stderr(log):
+        return namespace[name](value)
+
+
+def _frames_written(filename):
+    # frames saved so far by a TrajectoryWriter streaming to filename + '.iamtraj'
+    try:
+        with open(os.path.join(filename + ".iamtraj", "header.json")) as f:
+            return json.load(f)["n_frames"]
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def run_sweep(function, values, output=None, seed=0, max_workers=None, frames_per_run=None, force=False):
+    """
+    Calls ``function(value)`` for each value on a pool of processes, and returns the outputs.
+
+    :param function: a self-contained function, or a ``scwidgets`` code widget
+    :param values: the parameter values, e.g. a list of temperatures
+    :param output: format string giving the output file of a run, e.g.
+        ``'aluminum_langevin_T_{}.extxyz'``. If given, runs whose output is up to date are skipped
+    :param seed: base seed for the random number generators of the runs
+    :param max_workers: number of processes (defaults to the number of cores)
+    :param frames_per_run: number of frames written by each run. If given, and the function
+        streams its trajectory to ``output + '.iamtraj'``, the progress bar counts frames
+    :param force: if True, runs are repeated even if their output is up to date
+
+    :return: a dictionary {value: return value of the function}, with the file name for
+        runs that were skipped
+    """
+    from tqdm.auto import tqdm
+
+    source, name = _function_source(function)
+    key = function_key(function)
+    values = list(values)
+    results, pending = {}, []
+    for value in values:
+        if output is not None and not force and is_up_to_date(output.format(value), key, value, seed):
+            results[value] = output.format(value)
+        else:
+            pending.append(value)
+    if not pending:
+        return results
+
+    per_run = frames_per_run or 1
+    bar = tqdm(total=len(pending) * per_run, unit="frame" if frames_per_run else "run")
+    bar.set_description(f"{len(pending)} runs, {len(values) - len(pending)} up to date")
+    log_folder = os.path.join(os.getcwd(), CACHE_DIRNAME)
+    done = set()
+    # processes are spawned rather than forked, which is not safe from a running notebook kernel
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(
+                _run, source, name, value, _seed_state(seed, value),
+                os.path.join(log_folder, f"{name}_{value}.log"),
+            ): value
+            for value in pending
+        }
+        remaining = set(futures)
+        while remaining:
+            finished, remaining = wait(remaining, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in finished:
+                value = futures[future]
+                try:
+                    results[value] = future.result()
+                except Exception as exc:
+                    raise RuntimeError(f"The run for {value} failed, see the log in {log_folder}") from exc
+                done.add(value)
+                if output is not None and os.path.exists(output.format(value)):
+                    _record(output.format(value), key, value, seed)
+            progress = len(done) * per_run
+            if frames_per_run and output is not None:
+                progress += sum(
+                    min(_frames_written(output.format(v)), per_run) for v in pending if v not in done
+                )
+            bar.update(progress - bar.n)
+    bar.close()
+    return {value: results[value] for value in values}
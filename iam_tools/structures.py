@@ -0,0 +1,401 @@
+"""
+Binary cache for the structure files in ``data/``.
+
+Parsing extxyz text is slow, and several widgets re-read the same file every time they are
+updated. ``convert`` stores a structure file as a set of ``.npy`` columns (positions, numbers,
+cells, info fields, ...), and ``load_structures`` memory-maps them and builds ``ase.Atoms``
+objects only when they are accessed. The cache is rebuilt automatically when the source file
+changes (checked by size and modification time, and by content hash if only the time differs).
+
+The conversion reads the file one structure at a time and writes the columns in chunks, so
+that datasets larger than the available memory can be converted.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from collections.abc import Sequence
+
+import numpy as np
+
+CACHE_DIRNAME = ".iam_cache"
+_FORMAT_VERSION = 3
+_loaded = {}
+
+
+def _source_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_stamp(filename):
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def default_cache_dir(filename):
+    """
+    Folder where the cache for filename is stored, next to the source file.
+    """
+    folder, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(folder, CACHE_DIRNAME, name)
+
+
+def _encode_info(value):
+    # info entries that are not stored as columns go to the JSON manifest: arrays are tagged with
+    # their dtype so that they are read back as arrays, and anything else JSON can't hold is rejected
+    if isinstance(value, np.ndarray) and value.dtype.kind in "biufU":
+        return {"__ndarray__": value.tolist(), "dtype": value.dtype.str}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"info values of type {type(value).__name__} cannot be stored in the structure cache")
+
+
+def _decode_info(value):
+    if "__ndarray__" in value:
+        return np.array(value["__ndarray__"], dtype=value["dtype"])
+    return value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+
+
+def _per_atom_result(key):
+    from ase.outputs import all_outputs
+
+    output = all_outputs.get(key)
+    return output is not None and getattr(output, "shapespec", ())[:1] == ("natoms",)
+
+
+class _ColumnWriter:
+    # A column of the cache, with the type and shape of the value in the first structure. Values
+    # are appended to a raw file one chunk of structures at a time, and the raw file is turned into
+    # a .npy file at the end. Structures in which the value is missing, or has a different type
+    # or shape, are filled with zeros and flagged in a ``.present`` mask.
+
+    def __init__(self, path, first, per_atom=False):
+        first = np.asarray(first)
+        self.path = path
+        self.dtype = first.dtype
+        self.row_shape = first.shape[1:] if per_atom else first.shape
+        self.per_atom = per_atom
+        self.n_rows = 0
+        self.present = bytearray()
+        self._chunk = []
+        self._raw = open(path + ".raw", "wb")
+
+    def _fits(self, value, n_atoms):
+        if value is None:
+            return False
+        value = np.asarray(value)
+        shape = ((n_atoms,) if self.per_atom else ()) + self.row_shape
+        if value.shape != shape or (value.dtype.kind == "b") != (self.dtype.kind == "b"):
+            return False
+        return np.can_cast(value.dtype, self.dtype, "same_kind")
+
+    def append(self, value, n_atoms=1):
+        """
+        :return: whether the value was stored
+        """
+        fits = self._fits(value, n_atoms)
+        shape = ((n_atoms,) if self.per_atom else ()) + self.row_shape
+        self._chunk.append(np.asarray(value, dtype=self.dtype) if fits else np.zeros(shape, dtype=self.dtype))
+        self.present.append(fits)
+        return fits
+
+    def flush(self):
+        if self._chunk:
+            data = np.concatenate(self._chunk) if self.per_atom else np.stack(self._chunk)
+            self._raw.write(np.ascontiguousarray(data).tobytes())
+            self.n_rows += len(data)
+            self._chunk = []
+
+    def close(self):
+        """
+        :return: whether some structures are missing the value
+        """
+        self.flush()
+        self._raw.close()
+        header = {"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False,
+                  "shape": (self.n_rows,) + self.row_shape}
+        with open(self.path + ".npy", "wb") as f, open(self.path + ".raw", "rb") as raw:
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(raw, f, 1 << 20)
+        os.remove(self.path + ".raw")
+        if all(self.present):
+            return False
+        np.save(self.path + ".present.npy", np.frombuffer(self.present, dtype=bool))
+        return True
+
+
+def _frame_columns(frame, folder):
+    # the columns of the cache, {(family, key): writer}, with the keys and the types found in
+    # the first structure
+    columns = {}
+
+    def add(family, key, value, per_atom=False):
+        name = f"{family}.{key}" if family else key
+        columns[family, key] = _ColumnWriter(os.path.join(folder, name), value, per_atom)
+
+    def numeric(value):
+        return _is_number(value) or (isinstance(value, np.ndarray) and value.dtype.kind in "biuf")
+
+    add("", "cell", frame.cell.array)
+    add("", "pbc", frame.pbc)
+    for key, value in frame.arrays.items():
+        if value.dtype.kind in "biuf":
+            add("arrays", key, value, per_atom=True)
+    for key, value in frame.info.items():
+        if numeric(value):
+            add("info", key, value)
+    results = frame.calc.results if frame.calc is not None else {}
+    for key, value in results.items():
+        if _per_atom_result(key) and np.ndim(value) > 0 and len(value) == len(frame):
+            add("calc.atoms", key, value, per_atom=True)
+        elif numeric(value):
+            add("calc.frame", key, value)
+    return columns
+
+
+def convert(filename, cache_dir=None, chunk_size=1000):
+    """
+    Reads all the structures in filename, one at a time, and stores them as ``.npy`` columns.
+
+    Numeric ``info`` entries, per-atom arrays and single-point calculator results are stored
+    as columns, with the keys, types and shapes found in the first structure. All other ``info``
+    entries (and values that do not match the column) are stored in a JSON-lines file: strings,
+    booleans, numpy arrays and nested lists or dicts of them are supported, other types raise a
+    ``TypeError``. Per-atom arrays and calculator results that are not in the first structure,
+    or do not match its columns, are dropped.
+
+    :param filename: a structure file that can be read by ``ase.io.iread``
+    :param cache_dir: where to store the cache (defaults to ``default_cache_dir(filename)``)
+    :param chunk_size: number of structures that are held in memory before they are written
+
+    :return: the path of the cache folder
+    """
+    from ase.io import iread
+
+    cache_dir = cache_dir or default_cache_dir(filename)
+    stamp = _source_stamp(filename)
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    try:
+        columns, sizes, info_offsets = None, [], [0]
+        with open(os.path.join(tmp_dir, "other_info.jsonl"), "wb") as other_info:
+            for frame in iread(filename):
+                if columns is None:
+                    columns = _frame_columns(frame, tmp_dir)
+                n_atoms = len(frame)
+                sizes.append(n_atoms)
+                results = frame.calc.results if frame.calc is not None else {}
+                stored = set()
+                for (family, key), column in columns.items():
+                    if family == "":
+                        column.append(frame.cell.array if key == "cell" else frame.pbc)
+                    elif family == "arrays":
+                        column.append(frame.arrays.get(key), n_atoms)
+                    elif family == "info":
+                        if column.append(frame.info.get(key)):
+                            stored.add(key)
+                    else:
+                        column.append(results.get(key), n_atoms)
+                other = {k: v for k, v in frame.info.items() if k not in stored}
+                info_offsets.append(info_offsets[-1] + other_info.write(
+                    (json.dumps(other, default=_encode_info) + "\n").encode()
+                ))
+                if len(sizes) % chunk_size == 0:
+                    for column in columns.values():
+                        column.flush()
+        if columns is None:
+            raise ValueError(f"No structures found in {filename}")
+        masked = [os.path.basename(column.path) for column in columns.values() if column.close()]
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    np.save(os.path.join(tmp_dir, "offsets.npy"), np.concatenate([[0], np.cumsum(sizes)]))
+    np.save(os.path.join(tmp_dir, "other_info_offsets.npy"), np.array(info_offsets, dtype=np.int64))
+
+    def keys(family):
+        return sorted(key for f, key in columns if f == family)
+
+    manifest = {
+        "version": _FORMAT_VERSION,
+        "source": os.path.abspath(filename),
+        "sha256": _source_hash(filename),
+        "n_frames": len(sizes),
+        "arrays": keys("arrays"),
+        "info": keys("info"),
+        "calc_atoms": keys("calc.atoms"),
+        "calc_frame": keys("calc.frame"),
+        "masked": masked,
+        **stamp,
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    return cache_dir
+
+
+def _is_up_to_date(filename, cache_dir):
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != _FORMAT_VERSION:
+        return False
+    stamp = _source_stamp(filename)
+    if stamp["size"] != manifest["size"]:
+        return False
+    if stamp["mtime_ns"] != manifest["mtime_ns"]:
+        # touched but possibly not modified: compare the content
+        if _source_hash(filename) != manifest["sha256"]:
+            return False
+        manifest.update(stamp)
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+    return True
+
+
+class StructureCache(Sequence):
+    """
+    Memory-mapped collection of structures. Indexing with an integer returns a new
+    ``ase.Atoms``, indexing with a slice returns a list of them. Whole columns can be
+    accessed without building the structures, e.g. ``cache.info["K"]``.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: a folder created by ``convert``
+        """
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode="r")
+
+        self.offsets = load("offsets")
+        self.cell = load("cell")
+        self.pbc = load("pbc")
+        self.arrays = {key: load("arrays." + key) for key in self.manifest["arrays"]}
+        self.info = {key: load("info." + key) for key in self.manifest["info"]}
+        self._calc_atoms = {key: load("calc.atoms." + key) for key in self.manifest["calc_atoms"]}
+        self._calc_frame = {key: load("calc.frame." + key) for key in self.manifest["calc_frame"]}
+        # structures in which a column is missing, for the columns that are not in all of them
+        self._present = {name: load(name + ".present") for name in self.manifest["masked"]}
+        self._other_info_offsets = load("other_info_offsets")
+
+    def __len__(self):
+        return self.manifest["n_frames"]
+
+    @property
+    def numbers(self):
+        return self.arrays["numbers"]
+
+    @property
+    def positions(self):
+        return self.arrays["positions"]
+
+    def _has(self, name, index):
+        present = self._present.get(name)
+        return present is None or present[index]
+
+    def _other_info(self, index):
+        start, stop = self._other_info_offsets[index], self._other_info_offsets[index + 1]
+        with open(os.path.join(self.cache_dir, "other_info.jsonl"), "rb") as f:
+            f.seek(int(start))
+            return json.loads(f.read(int(stop - start)), object_hook=_decode_info)
+
+    def _build(self, index):
+        from ase import Atoms
+
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        structure = Atoms(
+            numbers=self.arrays["numbers"][start:stop],
+            positions=self.arrays["positions"][start:stop],
+            cell=self.cell[index],
+            pbc=self.pbc[index],
+        )
+        for key, values in self.arrays.items():
+            if key not in ("numbers", "positions") and self._has("arrays." + key, index):
+                structure.arrays[key] = np.array(values[start:stop])
+        for key, values in self.info.items():
+            if self._has("info." + key, index):
+                value = values[index]
+                structure.info[key] = value.item() if value.ndim == 0 else np.array(value)
+        structure.info.update(self._other_info(index))
+        results = {
+            key: np.array(v[start:stop])
+            for key, v in self._calc_atoms.items()
+            if self._has("calc.atoms." + key, index)
+        }
+        for key, values in self._calc_frame.items():
+            if self._has("calc.frame." + key, index):
+                value = values[index]
+                results[key] = value.item() if value.ndim == 0 else np.array(value)
+        if results:
+            from ase.calculators.singlepoint import SinglePointCalculator
+
+            structure.calc = SinglePointCalculator(structure, **results)
+        return structure
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._build(i) for i in range(*index.indices(len(self)))]
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"structure index {index} out of range")
+        return self._build(index)
+
+
+def load_structures(filename, cache_dir=None):
+    """
+    Returns a memory-mapped ``StructureCache`` for filename, converting it first if
+    there is no cache or if the cache is out of date.
+
+    :param filename: a structure file that can be read by ``ase.io.iread``
+    :param cache_dir: where to store the cache (defaults to ``default_cache_dir(filename)``)
+    """
+    cache_dir = cache_dir or default_cache_dir(filename)
+    key = (os.path.abspath(filename), cache_dir)
+    stamp = _source_stamp(filename)
+    cached = _loaded.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    if not _is_up_to_date(filename, cache_dir):
+        convert(filename, cache_dir)
+    structures = StructureCache(cache_dir)
+    _loaded[key] = (stamp, structures)
+    return structures
+
+
+def read_cached(filename, index=-1):
+    """
+    Drop-in replacement for ``ase.io.read`` that goes through the structure cache.
+
+    :param filename: a structure file that can be read by ``ase.io.read``
+    :param index: an integer, a slice, or a string such as ``":"`` or ``"::100"``
+
+    :return: an ase.Atoms object for an integer index, a list of them otherwise
+    """
+    structures = load_structures(filename)
+    if isinstance(index, str):
+        if ":" not in index:
+            return structures[int(index)]
+        index = slice(*[int(x) if x else None for x in index.split(":")])
+    return structures[index]
@@ -0,0 +1,198 @@
+"""
+Evaluation of a function over a grid of values, for the plotting callbacks of the widgets.
+
+``sweep`` first tries to call the function once on the whole grid, as most numerical functions
+work on numpy arrays. If that fails (or gives a result that does not match a point-by-point
+evaluation) the function is mapped over the grid with a thread or process pool. Results are kept
+in a small LRU cache keyed by the source of the function (and of the notebook functions it calls)
+and by the arguments, so that changing a parameter that does not enter the calculation (e.g. the
+range of the y axis) does not trigger a new sweep.
+"""
+
+import hashlib
+import inspect
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+
+def _global_names(code):
+    # names looked up by a code object and by the functions, lambdas and comprehensions it contains
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _global_names(const)
+    return names
+
+
+def _function_source(function):
+    source = getattr(function, "full_function_code", None)
+    if source is None:
+        try:
+            source = inspect.getsource(function)
+        except (OSError, TypeError):
+            code = getattr(function, "__code__", None)
+            if code is None:
+                return None
+            source = repr((code.co_code, code.co_consts, code.co_names))
+    return source + repr(getattr(function, "__defaults__", None))
+
+
+def function_key(function):
+    """
+    Hash identifying a function by its source, so that re-defining a function with the same
+    code (e.g. by re-running a notebook cell) gives the same key.
+
+    The source of the functions it calls, defined in the same module (e.g. in the notebook), is
+    included as well, so that re-defining one of them changes the key. Other global values that
+    the function reads, such as arrays or constants, are not part of the key.
+
+    The code widgets of ``scwidgets`` are identified by the code that was typed in them.
+    """
+    source = _function_source(function)
+    if source is None:
+        return ("object", id(function))
+    # the functions it calls, and those they call in turn, in a deterministic order
+    pending, seen = [function], {id(function)}
+    while pending:
+        caller = pending.pop()
+        code, namespace = getattr(caller, "__code__", None), getattr(caller, "__globals__", None)
+        if code is None or namespace is None:
+            continue
+        for name in sorted(_global_names(code)):
+            value = namespace.get(name)
+            if (inspect.isfunction(value) and id(value) not in seen
+                    and value.__module__ == caller.__module__):
+                seen.add(id(value))
+                pending.append(value)
+                source += f"\n{name}:{_function_source(value)}"
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _value_key(value):
+    # identifies an argument by its content: raises TypeError for values that cannot be
+    # compared this way, whose sweeps are not cached
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return ("object", value.shape, _value_key(value.ravel().tolist()))
+        return (value.dtype.str, value.shape, hashlib.sha1(np.ascontiguousarray(value)).hexdigest())
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_value_key(v) for v in value)
+    if isinstance(value, dict):
+        return ("dict",) + tuple((_value_key(k), _value_key(v)) for k, v in sorted(value.items(), key=repr))
+    if hasattr(value, "todict"):
+        # e.g. ase.Atoms, whose todict holds the numbers, positions, cell, pbc and other arrays
+        return (type(value).__qualname__, _value_key(value.todict()))
+    hash(value)
+    return value
+
+
+class SweepCache:
+    """
+    Least-recently-used cache of sweep results.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+
+    def get(self, key):
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        self._results.clear()
+
+    def __len__(self):
+        return len(self._results)
+
+
+default_cache = SweepCache()
+
+
+def _compiled(function):
+    # calling a scwidgets code widget compiles the code every time: compile it once
+    if getattr(function, "full_function_code", None) is not None:
+        return function.function
+    return function
+
+
+def _try_vectorized(function, grid, call):
+    try:
+        values = np.asarray(function(*call(grid)))
+    except Exception:
+        return None
+    if values.dtype == object or values.shape[:1] != grid.shape[:1]:
+        return None
+    # code written for scalars may still run on arrays and give a wrong result: check the ends
+    # and a few points in between
+    for i in np.unique(np.linspace(0, len(grid) - 1, 5).astype(int)):
+        try:
+            value = np.asarray(function(*call(grid[i])))
+        except Exception:
+            return None
+        if value.shape != values[i].shape or not np.allclose(value, values[i], equal_nan=True):
+            return None
+    return values
+
+
+def sweep(function, grid, *args, argnum=0, cache=default_cache, vectorize=True, pool="thread", max_workers=None):
+    """
+    Evaluates function over all the values in grid, as ``[function(x, *args) for x in grid]``.
+
+    :param function: a function, or a ``scwidgets`` code widget
+    :param grid: the values over which the function is evaluated
+    :param args: other arguments of the function, which must be the same for all the grid points
+    :param argnum: position of the grid argument among the arguments of the function
+        (negative values count from the end)
+    :param cache: a ``SweepCache``, or None to always recompute the sweep
+    :param vectorize: if True, first try to call the function on the whole grid
+    :param pool: "thread", "process" (the function must be picklable) or None to evaluate
+        the grid points one after the other
+    :param max_workers: number of workers of the pool
+
+    :return: an array with the values of the function, with len(grid) rows. The array
+        is shared with the cache, and should not be modified
+    """
+    grid = np.asarray(grid)
+    if argnum < 0:
+        argnum += len(args) + 1
+
+    def call(x):
+        return args[:argnum] + (x,) + args[argnum:]
+
+    key = None
+    if cache is not None:
+        try:
+            key = (function_key(function), _value_key(grid), argnum, tuple(_value_key(a) for a in args))
+        except TypeError:
+            pass
+    if key is not None:
+        values = cache.get(key)
+        if values is not None:
+            return values
+
+    function = _compiled(function)
+    values = _try_vectorized(function, grid, call) if vectorize else None
+    if values is None:
+        if pool is None or len(grid) < 2:
+            values = [function(*call(x)) for x in grid]
+        else:
+            executor = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}[pool]
+            with executor(max_workers=max_workers) as workers:
+                values = list(workers.map(function, *zip(*[call(x) for x in grid])))
+        values = np.asarray(values)
+
+    values.flags.writeable = False
+    if key is not None:
+        cache.put(key, values)
+    return values
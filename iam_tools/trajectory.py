@@ -0,0 +1,466 @@
+"""
+Random access to (ext)xyz trajectories.
+
+``TrajectoryReader`` scans a trajectory once to find the byte offset at which each frame
+starts, and stores the offsets next to the file so that the scan does not need to be
+repeated. Frames are then parsed only when they are accessed, so a long trajectory can be
+subsampled or streamed without holding all of it in memory.
+
+``TrajectoryWriter`` goes the other way: MD loops append frames to memory-mapped arrays on
+disk rather than to a list, and the result can be exported to extxyz when needed.
+"""
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import warnings
+
+import numpy as np
+
+from .structures import CACHE_DIRNAME
+
+
+def _index_path(filename):
+    folder, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(folder, CACHE_DIRNAME, name + ".frames.npz")
+
+
+def _scan_frames(buffer, start, end):
+    # returns the offsets of the complete frames in buffer[start:end], plus the end of the last one
+    offsets = [start]
+    position = start
+    frame_length = None
+    while position < end:
+        line_end = buffer.find(b"\n", position, end)
+        if line_end < 0:
+            break
+        header = buffer[position:line_end].strip()
+        if not header:
+            # skips blank lines between frames or at the end of the file
+            position = line_end + 1
+            offsets[-1] = position
+            continue
+        n_lines = int(header) + 2
+        # frames in a trajectory usually all have the same length: try that first
+        guess = position + frame_length if frame_length else -1
+        if 0 < guess <= end and buffer[guess - 1] == 10 and buffer[position:guess].count(b"\n") == n_lines:
+            next_position = guess
+        else:
+            next_position = position
+            for _ in range(n_lines):
+                next_position = buffer.find(b"\n", next_position, end)
+                if next_position < 0:
+                    break
+                next_position += 1
+            if next_position < 0:
+                # incomplete frame, e.g. a file that is still being written
+                break
+        frame_length = next_position - position
+        position = next_position
+        offsets.append(position)
+    return np.asarray(offsets, dtype=np.int64)
+
+
+class TrajectoryReader:
+    """
+    Lazy, random-access reader for xyz/extxyz trajectories.
+
+    ``reader[i]`` parses and returns a single frame as ``ase.Atoms``, ``reader[::stride]``
+    returns another reader over the selected frames, and iterating over a reader yields the
+    frames one at a time. ``len(reader)`` is the number of frames.
+    """
+
+    def __init__(self, filename, persist=True, _frames=None, _offsets=None):
+        """
+        :param filename: path to the trajectory file
+        :param persist: whether to store the frame index in a cache folder next to the file
+        """
+        self.filename = filename
+        self.persist = persist
+        if _offsets is None:
+            _offsets = self._build_index()
+        self._offsets = _offsets
+        self._frames = np.arange(len(_offsets) - 1) if _frames is None else _frames
+
+    def _build_index(self):
+        stat = os.stat(self.filename)
+        index_path = _index_path(self.filename)
+        offsets = np.zeros(1, dtype=np.int64)
+        if self.persist and os.path.exists(index_path):
+            stored = np.load(index_path)
+            offsets = stored["offsets"]
+            unchanged = stored["size"] == stat.st_size and stored["mtime_ns"] == stat.st_mtime_ns
+            if unchanged:
+                return offsets
+            # an appended file keeps the frames that have already been indexed
+            if stat.st_size < offsets[-1] or self._tail_hash(offsets) != str(stored["tail_sha1"]):
+                offsets = np.zeros(1, dtype=np.int64)
+
+        if stat.st_size > offsets[-1]:
+            with open(self.filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                offsets = np.concatenate([offsets[:-1], _scan_frames(buffer, int(offsets[-1]), stat.st_size)])
+
+        if self.persist:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            np.savez(
+                index_path,
+                offsets=offsets,
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                tail_sha1=self._tail_hash(offsets),
+            )
+        return offsets
+
+    def _tail_hash(self, offsets):
+        # hash of the last indexed frame, to detect files that have been rewritten rather than appended to
+        if len(offsets) < 2:
+            return ""
+        with open(self.filename, "rb") as f:
+            f.seek(int(offsets[-2]))
+            return hashlib.sha1(f.read(int(offsets[-1] - offsets[-2]))).hexdigest()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def _read_frame(self, f, frame):
+        from ase.io import read
+
+        start, stop = self._offsets[frame], self._offsets[frame + 1]
+        f.seek(int(start))
+        text = f.read(int(stop - start)).decode()
+        return read(io.StringIO(text), index=0, format="extxyz")
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TrajectoryReader(
+                self.filename, self.persist, _frames=self._frames[index], _offsets=self._offsets
+            )
+        with open(self.filename, "rb") as f:
+            return self._read_frame(f, self._frames[index])
+
+    def __iter__(self):
+        with open(self.filename, "rb") as f:
+            for frame in self._frames:
+                yield self._read_frame(f, frame)
+
+    def frame_offsets(self):
+        """
+        Byte offsets at which the selected frames start in the file.
+        """
+        return self._offsets[self._frames]
+
+
+def read_frames(filename, index=":"):
+    """
+    Reads frames from a trajectory through a ``TrajectoryReader``, similar to ``ase.io.read``.
+
+    :param filename: path to the trajectory file
+    :param index: an integer, a slice, or a string such as ``":"`` or ``"::10"``
+
+    :return: an ase.Atoms object for an integer index, a list of them otherwise
+    """
+    reader = TrajectoryReader(filename)
+    if isinstance(index, str):
+        if ":" not in index:
+            return reader[int(index)]
+        index = slice(*[int(x) if x else None for x in index.split(":")])
+    if isinstance(index, slice):
+        return list(reader[index])
+    return reader[index]
+
+
+class _Column:
+    # an on-disk array of rows, grown in chunks and accessed through a memory map
+    def __init__(self, path, row_shape, dtype, chunk_size, n_rows=0):
+        self.path = path
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape, dtype=int))
+        self.capacity = 0
+        self.data = None
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        self.capacity = os.path.getsize(path) // self.row_bytes
+        self._reserve(max(n_rows, 1))
+
+    def _reserve(self, n_rows):
+        if n_rows <= self.capacity and self.data is not None:
+            return
+        if n_rows > self.capacity:
+            self.flush()
+            self.data = None
+            self.capacity = self.chunk_size * -(-n_rows // self.chunk_size)
+            with open(self.path, "r+b") as f:
+                f.truncate(self.capacity * self.row_bytes)
+        self.data = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(self.capacity,) + self.row_shape)
+
+    def write(self, row, value):
+        self._reserve(row + 1)
+        self.data[row] = value
+
+    def flush(self):
+        if self.data is not None:
+            self.data.flush()
+
+    def astype(self, dtype):
+        # converts the rows written so far, e.g. an integer column that receives a float
+        self.flush()
+        converted = np.asarray(self.data, dtype=dtype)
+        self.data = None
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape, dtype=int))
+        converted.tofile(self.path)
+        self.capacity = len(converted)
+        self._reserve(self.capacity)
+
+
+class TrajectoryWriter:
+    """
+    Append-only trajectory store for MD loops.
+
+    Each frame adds a row to a set of on-disk arrays (positions, velocities, cell, and one
+    column for each numeric ``info`` entry, plus the temperature and volume), which are
+    preallocated in chunks and memory-mapped, so that memory usage does not grow with the
+    length of the trajectory. The number of complete frames is saved every ``flush_every``
+    frames, so a crash loses at most the frames written since the last flush. The store can
+    be converted to extxyz at any time with ``to_extxyz``, or read back with ``TrajectoryStore``.
+
+    Use it as a context manager, or call ``close()`` at the end::
+
+        with TrajectoryWriter("md.iamtraj") as writer:
+            for i in range(nsteps):
+                dyn.run(10)
+                writer.append(structure)
+        writer.to_extxyz("md.extxyz")
+    """
+
+    def __init__(self, path, chunk_size=256, flush_every=16, append=False):
+        """
+        :param path: folder in which the arrays are stored
+        :param chunk_size: number of frames by which the arrays are grown
+        :param flush_every: number of frames between flushes to disk
+        :param append: if True, continues an existing store rather than overwriting it
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.flush_every = flush_every
+        self.header = None
+        self.columns = {}
+        if append and os.path.exists(os.path.join(path, "header.json")):
+            self.header = _read_header(path)
+            self._open_columns()
+        else:
+            import shutil
+
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+
+    @property
+    def n_frames(self):
+        return 0 if self.header is None else self.header["n_frames"]
+
+    def _open_columns(self):
+        n_atoms = len(self.header["numbers"])
+        shapes = {"positions": (n_atoms, 3), "velocities": (n_atoms, 3), "cell": (3, 3)}
+        dtypes = {"info." + k: dtype for k, dtype in _scalar_dtypes(self.header).items()}
+        for name in ["positions", "velocities", "cell"] + ["info." + k for k in self.header["scalars"]]:
+            self.columns[name] = _Column(
+                os.path.join(self.path, name + ".bin"), shapes.get(name, ()), dtypes.get(name, "float64"),
+                self.chunk_size, self.n_frames,
+            )
+
+    def _scalars(self, structure):
+        scalars = {
+            key: value
+            for key, value in structure.info.items()
+            if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+        }
+        if self.header is None and len(scalars) < len(structure.info):
+            skipped = ", ".join(key for key in structure.info if key not in scalars)
+            warnings.warn(f"Only numbers can be stored in a trajectory: the info entries {skipped} are dropped")
+        scalars.setdefault("temperature", structure.get_temperature())
+        if structure.cell.rank == 3:
+            scalars.setdefault("volume", structure.get_volume())
+        else:
+            scalars.setdefault("volume", 0.0)
+        return scalars
+
+    def append(self, structure):
+        """
+        Stores a frame. All frames must have the same atoms, and the same ``info`` entries
+        as the first one.
+
+        :param structure: an ase.Atoms object
+        """
+        scalars = self._scalars(structure)
+        if self.header is None:
+            self.header = {
+                "n_frames": 0,
+                "numbers": structure.numbers.tolist(),
+                "masses": structure.get_masses().tolist(),
+                "pbc": structure.pbc.tolist(),
+                "momenta": structure.has("momenta"),
+                "scalars": list(scalars),
+                # integer entries, e.g. step counters, keep their type as long as all their values
+                # are integers
+                "dtypes": {
+                    key: "int64" if isinstance(value, (int, np.integer)) else "float64"
+                    for key, value in scalars.items()
+                },
+                "derived": [k for k in ("temperature", "volume") if k not in structure.info],
+            }
+            self._open_columns()
+        elif len(structure) != len(self.header["numbers"]):
+            raise ValueError("All frames of a trajectory must have the same number of atoms")
+
+        row = self.n_frames
+        self.columns["positions"].write(row, structure.positions)
+        self.columns["velocities"].write(row, structure.get_velocities())
+        self.columns["cell"].write(row, structure.cell.array)
+        for key in self.header["scalars"]:
+            column = self.columns["info." + key]
+            value = scalars.get(key)
+            if column.dtype.kind != "f" and value is not None and not isinstance(value, (int, np.integer)):
+                column.astype("float64")
+                self.header["dtypes"][key] = "float64"
+                self.flush()
+            # entries missing from a frame are stored as NaN, or as 0 in integer columns
+            column.write(row, scalars.get(key, np.nan if column.dtype.kind == "f" else 0))
+        self.header["n_frames"] += 1
+        if self.header["n_frames"] % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the pending frames to disk, and records how many frames are complete.
+        """
+        if self.header is None:
+            return
+        for column in self.columns.values():
+            column.flush()
+        tmp = os.path.join(self.path, "header.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.header, f)
+        os.replace(tmp, os.path.join(self.path, "header.json"))
+
+    def truncate(self, n_frames):
+        """
+        Drops the frames after the first n_frames, e.g. those written after the last checkpoint
+        of a simulation that is being restarted.
+        """
+        if n_frames > self.n_frames:
+            raise ValueError(f"Cannot truncate {self.n_frames} frames to {n_frames}")
+        if self.header is not None:
+            self.header["n_frames"] = n_frames
+            self.flush()
+
+    def close(self):
+        self.flush()
+        self.columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def to_extxyz(self, filename, stride=1, derived=False):
+        """
+        Exports the frames written so far, see ``TrajectoryStore.to_extxyz``.
+        """
+        self.flush()
+        return TrajectoryStore(self.path).to_extxyz(filename, stride=stride, derived=derived)
+
+
+def _read_header(path):
+    with open(os.path.join(path, "header.json")) as f:
+        return json.load(f)
+
+
+def _scalar_dtypes(header):
+    # stores written before the dtypes were recorded only have float64 columns
+    dtypes = header.get("dtypes", {})
+    return {key: dtypes.get(key, "float64") for key in header["scalars"]}
+
+
+class TrajectoryStore:
+    """
+    Read-only view of the frames saved by a ``TrajectoryWriter``. Columns can be accessed
+    directly as memory-mapped arrays (``store.positions``, ``store.info["time"]``), and
+    ``store[i]`` returns the i-th frame as ``ase.Atoms``.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: folder written by a TrajectoryWriter
+        """
+        self.path = path
+        self.header = _read_header(path)
+        n_frames, n_atoms = self.header["n_frames"], len(self.header["numbers"])
+
+        def load(name, shape, dtype="float64"):
+            if n_frames == 0:
+                return np.zeros((0,) + shape, dtype=dtype)
+            return np.memmap(os.path.join(path, name + ".bin"), dtype=dtype, mode="r", shape=(n_frames,) + shape)
+
+        self.positions = load("positions", (n_atoms, 3))
+        self.velocities = load("velocities", (n_atoms, 3))
+        self.cell = load("cell", (3, 3))
+        self.info = {key: load("info." + key, (), dtype) for key, dtype in _scalar_dtypes(self.header).items()}
+
+    def __len__(self):
+        return self.header["n_frames"]
+
+    def frame(self, index, derived=True):
+        """
+        Builds the index-th frame as ``ase.Atoms``, with momenta and info entries.
+
+        :param derived: whether to include the temperature and volume that were computed
+            by the writer, rather than given in ``info``
+        """
+        from ase import Atoms
+
+        structure = Atoms(
+            numbers=self.header["numbers"],
+            positions=self.positions[index],
+            cell=self.cell[index],
+            pbc=self.header["pbc"],
+        )
+        if not np.allclose(structure.get_masses(), self.header["masses"]):
+            structure.set_masses(self.header["masses"])
+        if self.header["momenta"]:
+            structure.set_velocities(self.velocities[index])
+        skip = () if derived else self.header["derived"]
+        for key, values in self.info.items():
+            if key not in skip:
+                structure.info[key] = values[index].item()
+        return structure
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.frame(i) for i in range(*index.indices(len(self)))]
+        return self.frame(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    def to_extxyz(self, filename, stride=1, derived=False):
+        """
+        Writes the frames to an extxyz file, one at a time.
+
+        :param filename: output file
+        :param stride: only writes one frame every stride
+        :param derived: whether to also write the temperature and volume computed by the writer
+
+        :return: filename
+        """
+        from ase.io import write
+
+        with open(filename, "w") as f:
+            for i in range(0, len(self), stride):
+                write(f, self.frame(i, derived=derived), format="extxyz")
+        return filename
@@ -3,6 +3,7 @@
 # that facilitates going through a list of solutions from students
 
 import argparse
+import inspect
 import json
 import re
 from pathlib import Path
@@ -98,6 +99,45 @@ def detect_exercise_order(cells):
     return order
 
 
+def normalized_code(code):
+    """
+    Code without its comments and formatting: the dump of its syntax tree, or the code with
+    whitespace and full-line comments stripped if it does not parse.
+    """
+    import ast
+    import textwrap
+
+    try:
+        return ast.dump(ast.parse(textwrap.dedent(code)))
+    except (SyntaxError, ValueError):
+        lines = (line.split() for line in code.splitlines() if not line.lstrip().startswith("#"))
+        return "\n".join(" ".join(words) for words in lines if words)
+
+
+def answer_hash(answer):
+    """
+    Content hash of an answer, the same for answers that only differ by formatting or comments;
+    None for an empty answer.
+    """
+    import hashlib
+    import json
+
+    if not isinstance(answer, dict):
+        return None
+    fields = {}
+    for key in ("textarea", "code", "parameters_panel", "selection"):
+        value = answer.get(key)
+        if key == "code" and value:
+            value = normalized_code(value)
+        elif key == "textarea" and value:
+            value = " ".join(value.split())
+        if value or value == 0:
+            fields[key] = value
+    if not fields.keys() - {"parameters_panel"}:
+        return None
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
 def remove_previous_patch(cells):
     out = []
     skip_summary_code = False
@@ -126,6 +166,7 @@ def remove_previous_patch(cells):
 
 
 def insert_setup_and_nav(cells, module_prefix, submissions_dir, reference_dir, grades_csv):
+    hashing = inspect.getsource(normalized_code) + "\n\n" + inspect.getsource(answer_hash)
     setup = f'''# ═══════════════════════════════════════════════════════════════
 # GRADING MODE — run after creating exercise_registry/check_registry
 # ═══════════════════════════════════════════════════════════════
@@ -133,7 +174,12 @@ import json as _json
 import csv as _csv
 import glob as _glob
 import os as _os
+import sqlite3 as _sqlite3
+import threading as _threading
+import time as _time
 import traceback as _traceback
+from contextlib import closing as _closing
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
 import ipywidgets as _widgets
 
 _MODULE_PREFIX = "{module_prefix}"
@@ -142,21 +188,77 @@ _TA_REVIEWS_DIR = _os.path.join(_SUBMISSIONS_DIR, "ta_reviews")
 _REFERENCE_DIR = "{reference_dir}"
 _GRADES_CSV = "{grades_csv}"
 
+{hashing}
 with open(_os.path.join(_REFERENCE_DIR, f"{{_MODULE_PREFIX}}-referenceanswers.json")) as _f:
     _reference_answers = _json.load(_f)
 
 _required_keys = set(_reference_answers.keys())
 _student_files = []
 _student_names = []
+_submissions_stamp = {{"value": None}}
+# name -> ((path, mtime, size), answers): a student's file is parsed only when they are
+# first viewed, or when the file has changed since it was parsed
 _student_answers_cache = {{}}
+_student_cache_lock = _threading.Lock()
+_prefetch_pool = _ThreadPoolExecutor(max_workers=1)
+_prefetching = {{}}
+
+# scores, comments and edited answers live in a SQLite database next to the grades CSV, and each
+# save is a single transaction; the CSV and the ta_reviews JSON files are written by _export_grades
+_GRADES_DB = _os.path.splitext(_GRADES_CSV)[0] + ".sqlite"
+
+def _grades_db():
+    return _sqlite3.connect(_GRADES_DB, timeout=30)
 
 _grades = {{}}
 _comments = {{}}
-if _os.path.exists(_GRADES_CSV):
-    with open(_GRADES_CSV, newline="") as _f:
-        for _row in _csv.DictReader(_f):
-            _grades[(_row["student"], _row["exercise"])] = _row["score"]
-            _comments[(_row["student"], _row["exercise"])] = _row.get("comment", "")
+_review_updated = {{}}
+# (exercise, answer_hash) -> (score, comment, student, updated): a review also applies to the
+# identical answers of other students, unless they have a more recent review of their own
+_shared_reviews = {{}}
+with _closing(_grades_db()) as _db, _db:
+    # write-ahead logging lets several TAs save at the same time
+    _db.execute("PRAGMA journal_mode=WAL")
+    _db_is_new = _db.execute("SELECT name FROM sqlite_master WHERE name = 'reviews'").fetchone() is None
+    _db.execute(
+        "CREATE TABLE IF NOT EXISTS reviews (student TEXT, exercise TEXT, score TEXT, comment TEXT, "
+        "answer TEXT, updated REAL, PRIMARY KEY (student, exercise))"
+    )
+    _db.execute(
+        "CREATE TABLE IF NOT EXISTS answer_reviews (exercise TEXT, hash TEXT, score TEXT, comment TEXT, "
+        "student TEXT, updated REAL, PRIMARY KEY (exercise, hash))"
+    )
+    # index of the answers of all the students by hash, updated by _index_answers
+    _db.execute("CREATE TABLE IF NOT EXISTS answer_hashes (student TEXT, exercise TEXT, hash TEXT, PRIMARY KEY (student, exercise))")
+    _db.execute("CREATE TABLE IF NOT EXISTS answer_stamps (student TEXT PRIMARY KEY, stamp TEXT)")
+    if _db_is_new and _os.path.exists(_GRADES_CSV):
+        with open(_GRADES_CSV, newline="") as _f:
+            _db.executemany(
+                "INSERT OR REPLACE INTO reviews (student, exercise, score, comment, updated) VALUES (?, ?, ?, ?, ?)",
+                [(_row["student"], _row["exercise"], _row["score"], _row.get("comment", ""), _time.time())
+                 for _row in _csv.DictReader(_f)],
+            )
+    for _stu, _ex, _score, _comment, _updated in _db.execute("SELECT student, exercise, score, comment, updated FROM reviews"):
+        if _score is not None:
+            _grades[(_stu, _ex)] = _score
+        if _comment is not None:
+            _comments[(_stu, _ex)] = _comment
+        _review_updated[(_stu, _ex)] = _updated or 0
+    for _ex, _hash, _score, _comment, _stu, _updated in _db.execute("SELECT * FROM answer_reviews"):
+        _shared_reviews[(_ex, _hash)] = (_score, _comment, _stu, _updated)
+
+def _db_write(name, ex_key, **fields):
+    _columns = ", ".join(f"{{_c}} = ?" for _c in fields)
+    with _closing(_grades_db()) as _db, _db:
+        _db.execute("INSERT OR IGNORE INTO reviews (student, exercise) VALUES (?, ?)", (name, ex_key))
+        _db.execute(
+            f"UPDATE reviews SET {{_columns}}, updated = ? WHERE student = ? AND exercise = ?",
+            (*fields.values(), _time.time(), name, ex_key),
+        )
+
+def _db_version(name):
+    with _closing(_grades_db()) as _db:
+        return _db.execute("SELECT max(updated) FROM reviews WHERE student = ?", (name,)).fetchone()[0]
 
 def _student_submission_path(name):
     return _os.path.join(_SUBMISSIONS_DIR, f"{{_MODULE_PREFIX}}-{{name}}.json")
@@ -227,19 +329,52 @@ def _load_student_file_raw(name):
 
 def _load_student_file(name):
     _raw_answers = _load_student_file_raw(name)
-    return {{_k: _normalize_loaded_answer(_v) for _k, _v in _raw_answers.items()}}
-
-def _save_grades():
-    with open(_GRADES_CSV, "w", newline="") as _f:
-        w = _csv.DictWriter(_f, fieldnames=["student", "exercise", "score", "comment"])
-        w.writeheader()
-        for stu, ex in sorted(set(_grades) | set(_comments)):
-            w.writerow({{
-                "student": stu,
-                "exercise": ex,
-                "score": _grades.get((stu, ex), ""),
-                "comment": _comments.get((stu, ex), ""),
-            }})
+    _answers = {{_k: _normalize_loaded_answer(_v) for _k, _v in _raw_answers.items()}}
+    # answers edited by a TA take precedence over the submitted ones
+    with _closing(_grades_db()) as _db:
+        for _ex, _answer in _db.execute(
+            "SELECT exercise, answer FROM reviews WHERE student = ? AND answer IS NOT NULL", (name,)
+        ):
+            _answers[_ex] = _json.loads(_answer)
+    return _answers
+
+def _file_stamp(path):
+    try:
+        _st = _os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, _st.st_mtime_ns, _st.st_size)
+
+def _cached_student_answers(name):
+    _stamp = (_file_stamp(_student_active_path(name)), _db_version(name))
+    with _student_cache_lock:
+        _entry = _student_answers_cache.get(name)
+    if _entry is not None and _entry[0] == _stamp:
+        return _entry[1]
+    try:
+        _answers = _load_student_file(name)
+    except Exception:
+        _answers = {{}}
+    with _student_cache_lock:
+        _student_answers_cache[name] = (_stamp, _answers)
+    return _answers
+
+def _student_answers(name):
+    # waits for a prefetch of the same student rather than parsing the file twice
+    _future = _prefetching.pop(name, None)
+    if _future is not None:
+        _future.result()
+    return _cached_student_answers(name)
+
+def _prefetch(names):
+    for _name in names:
+        if _name is not None and (_name not in _prefetching or _prefetching[_name].done()):
+            _prefetching[_name] = _prefetch_pool.submit(_cached_student_answers, _name)
+
+def _prefetch_neighbours():
+    if _student_names:
+        _idx = _student_idx["value"]
+        _prefetch([_student_names[(_idx + 1) % len(_student_names)], _student_names[(_idx - 1) % len(_student_names)]])
 
 def _save_review(ex_key, score, comment):
     name = _current_student()
@@ -247,19 +382,81 @@ def _save_review(ex_key, score, comment):
         raise ValueError("No student selected")
     _grades[(name, ex_key)] = score
     _comments[(name, ex_key)] = comment
-    _save_review_entry(ex_key, score=score, comment=comment)
-    _save_grades()
+    _db_write(name, ex_key, score=score, comment=comment)
+    _updated = _time.time()
+    _review_updated[(name, ex_key)] = _updated
+    _hash = answer_hash(_current_student_answers["value"].get(ex_key))
+    if _hash is not None:
+        _shared_reviews[(ex_key, _hash)] = (score, comment, name, _updated)
+        with _closing(_grades_db()) as _db, _db:
+            _db.execute(
+                "INSERT OR REPLACE INTO answer_reviews VALUES (?, ?, ?, ?, ?, ?)",
+                (ex_key, _hash, score, comment, name, _updated),
+            )
     return name
 
-def _save_review_entry(ex_key, score=None, comment=None, answer=None):
-    name = _current_student()
-    if name is None:
-        raise ValueError("No student selected")
-    _answers = dict(_load_student_file_raw(name))
-    _existing = _answers.get(ex_key, {{}})
-    _existing_normalized = _normalize_loaded_answer(_existing)
-    _ta_comment = _existing.get("ta_comment", "") if isinstance(_existing, dict) else ""
-    _ta_score = _existing.get("ta_score", "") if isinstance(_existing, dict) else ""
+def _index_answers():
+    # hashes the answers of the students whose file or edited answers changed since they were indexed
+    with _closing(_grades_db()) as _db, _db:
+        _stamps = dict(_db.execute("SELECT student, stamp FROM answer_stamps"))
+        _versions = dict(_db.execute("SELECT student, max(updated) FROM reviews GROUP BY student"))
+        for name in _student_names:
+            _stamp = _json.dumps([_file_stamp(_student_active_path(name)), _versions.get(name)])
+            if _stamps.get(name) == _stamp:
+                continue
+            try:
+                _answers = _load_student_file(name)
+            except Exception:
+                _answers = {{}}
+            _hashes = [(name, _ex, answer_hash(_answer)) for _ex, _answer in _answers.items()]
+            _db.execute("DELETE FROM answer_hashes WHERE student = ?", (name,))
+            _db.executemany("INSERT INTO answer_hashes VALUES (?, ?, ?)", [_h for _h in _hashes if _h[2] is not None])
+            _db.execute("INSERT OR REPLACE INTO answer_stamps VALUES (?, ?)", (name, _stamp))
+
+def _effective_reviews():
+    # [(student, exercise, score, comment, answer)], where reviews of identical answers fill in
+    # for the students without a more recent review of their own
+    with _closing(_grades_db()) as _db:
+        _rows = {{
+            (_stu, _ex): [_stu, _ex, _score, _comment, _answer, _updated or 0]
+            for _stu, _ex, _score, _comment, _answer, _updated in _db.execute(
+                "SELECT student, exercise, score, comment, answer, updated FROM reviews"
+            )
+        }}
+        _shared = _db.execute(
+            "SELECT h.student, h.exercise, r.score, r.comment, r.updated FROM answer_hashes h "
+            "JOIN answer_reviews r ON h.exercise = r.exercise AND h.hash = r.hash"
+        ).fetchall()
+    for _stu, _ex, _score, _comment, _updated in _shared:
+        _row = _rows.setdefault((_stu, _ex), [_stu, _ex, None, None, None, 0])
+        if _updated > _row[5]:
+            _row[2:4] = [_score, _comment]
+    return [tuple(_row[:5]) for _key, _row in sorted(_rows.items())]
+
+def _review_for(name, ex_key):
+    # (score, comment, note), with the review of an identical answer if it is more recent
+    if not name:
+        return "", "", ""
+    _score, _comment, _note = _grades.get((name, ex_key), ""), _comment_for(name, ex_key), ""
+    _hash = answer_hash(_current_student_answers["value"].get(ex_key))
+    _shared = _shared_reviews.get((ex_key, _hash))
+    if _shared is not None and _shared[2] != name and _shared[3] > _review_updated.get((name, ex_key), 0):
+        _score, _comment = _shared[0] or "", _shared[1] or ""
+        _note = f"review of the identical answer of {{_shared[2]}}"
+    if _hash is not None:
+        with _closing(_grades_db()) as _db:
+            _same = _db.execute(
+                "SELECT count(*) FROM answer_hashes WHERE exercise = ? AND hash = ? AND student != ?",
+                (ex_key, _hash, name),
+            ).fetchone()[0]
+        if _same:
+            _note = (_note + "; " if _note else "") + f"{{_same}} other identical answers"
+    return _score, _comment, _note
+
+def _review_entry(existing, score=None, comment=None, answer=None):
+    _existing_normalized = _normalize_loaded_answer(existing)
+    _ta_comment = existing.get("ta_comment", "") if isinstance(existing, dict) else ""
+    _ta_score = existing.get("ta_score", "") if isinstance(existing, dict) else ""
 
     if answer is not None:
         _base_answer = _extract_answer_fields(answer)
@@ -279,28 +476,62 @@ def _save_review_entry(ex_key, score=None, comment=None, answer=None):
         _entry["ta_comment"] = _comment
     if _score is not None:
         _entry["ta_score"] = _score
+    return _entry
+
+def _write_replacing(path, write):
+    # written to a temporary file first, so a crash never leaves a truncated file behind
+    with open(path + ".tmp", "w", newline="") as _f:
+        write(_f)
+    _os.replace(path + ".tmp", path)
 
-    _answers[ex_key] = _entry
+def _export_grades():
+    _index_answers()
+    _rows = _effective_reviews()
 
+    def _write_csv(f):
+        w = _csv.DictWriter(f, fieldnames=["student", "exercise", "score", "comment"])
+        w.writeheader()
+        for stu, ex, score, comment, _ in _rows:
+            w.writerow({{
+                "student": stu,
+                "exercise": ex,
+                "score": "" if score is None else score,
+                "comment": "" if comment is None else comment,
+            }})
+    _write_replacing(_GRADES_CSV, _write_csv)
+
+    _reviews = {{}}
+    for stu, ex, score, comment, answer in _rows:
+        _reviews.setdefault(stu, []).append((ex, score, comment, None if answer is None else _json.loads(answer)))
     _os.makedirs(_TA_REVIEWS_DIR, exist_ok=True)
-    _fp = _student_review_path(name)
-    with open(_fp, "w") as _f:
-        _json.dump(_answers, _f, indent=2, ensure_ascii=False)
-        _f.write("\\n")
+    for name, _entries in _reviews.items():
+        _answers = dict(_load_student_file_raw(name))
+        for ex, score, comment, answer in _entries:
+            _answers[ex] = _review_entry(_answers.get(ex, {{}}), score, comment, answer)
 
-    _student_answers_cache[name] = _answers
-    _current_student_answers["value"] = _answers
-    return name
+        def _write_json(f, _answers=_answers):
+            _json.dump(_answers, f, indent=2, ensure_ascii=False)
+            f.write("\\n")
+        _write_replacing(_student_review_path(name), _write_json)
+    return len(_rows)
 
 def _save_current_student_answer(ex_key):
     if ex_key not in _code_widget_panels:
         raise KeyError(f"Unknown code panel: {{ex_key}}")
 
-    _template_widget, _container, _student_widget = _code_widget_panels[ex_key]
+    _student_widget = _code_widget_panels[ex_key]["student"]
     if _student_widget is None:
         raise ValueError(f"No loaded student widget for {{ex_key}}")
 
-    return _save_review_entry(ex_key, answer=_student_widget.answer)
+    name = _current_student()
+    if name is None:
+        raise ValueError("No student selected")
+    _answer = _extract_answer_fields(_student_widget.answer)
+    _db_write(name, ex_key, answer=_json.dumps(_answer))
+    _answers = dict(_current_student_answers["value"])
+    _answers[ex_key] = _answer
+    _current_student_answers["value"] = _answers
+    return name
 
 _ref_exercise_registry = ExerciseRegistry(filename_prefix=_MODULE_PREFIX)
 for _k in sorted(k for k in _required_keys if not k.endswith('-function')):
@@ -314,7 +545,12 @@ def _current_student():
     return _student_names[_student_idx["value"]] if _student_names else None
 
 def _refresh_student_cache(force=False):
-    global _student_files, _student_names, _student_answers_cache
+    global _student_files, _student_names
+    # files can only have been added or removed if the folder has a new mtime
+    _stamp = _file_stamp(_SUBMISSIONS_DIR)
+    if (not force) and _stamp == _submissions_stamp["value"]:
+        return
+    _submissions_stamp["value"] = _stamp
     _files = sorted(_glob.glob(_os.path.join(_SUBMISSIONS_DIR, f"{{_MODULE_PREFIX}}-*.json")))
     if (not force) and _files == _student_files:
         return
@@ -325,12 +561,9 @@ def _refresh_student_cache(force=False):
         _os.path.basename(f).replace(f"{{_MODULE_PREFIX}}-", "").replace(".json", "")
         for f in _student_files
     ]
-    _student_answers_cache = {{}}
-    for _fp, _name in zip(_student_files, _student_names):
-        try:
-            _student_answers_cache[_name] = _load_student_file(_name)
-        except Exception:
-            _student_answers_cache[_name] = {{}}
+    with _student_cache_lock:
+        for _name in set(_student_answers_cache) - set(_student_names):
+            del _student_answers_cache[_name]
 
     _nav_dropdown.options = [(f"{{i+1}}. {{n}}", i) for i, n in enumerate(_student_names)]
     if not _student_names:
@@ -392,13 +625,36 @@ def _load_into_registry(registry, filepath, who):
 def _load_reference():
     _ref_loaded["value"] = True
 
+def _load_student_reviews(name):
+    # re-reads the reviews of a student, and those of identical answers, so that the scores and
+    # comments saved by other TAs since this view was opened are shown
+    _hashes = [(_ex, answer_hash(_answer)) for _ex, _answer in _current_student_answers["value"].items()]
+    with _closing(_grades_db()) as _db:
+        _rows = _db.execute("SELECT exercise, score, comment, updated FROM reviews WHERE student = ?", (name,)).fetchall()
+        _shared = [
+            _db.execute("SELECT * FROM answer_reviews WHERE exercise = ? AND hash = ?", (_ex, _hash)).fetchone()
+            for _ex, _hash in _hashes if _hash is not None
+        ]
+    for _ex, _score, _comment, _updated in _rows:
+        if _score is not None:
+            _grades[(name, _ex)] = _score
+        if _comment is not None:
+            _comments[(name, _ex)] = _comment
+        _review_updated[(name, _ex)] = _updated or 0
+    for _row in _shared:
+        if _row is not None:
+            _ex, _hash, _score, _comment, _stu, _updated = _row
+            _shared_reviews[(_ex, _hash)] = (_score, _comment, _stu, _updated)
+
 def _load_current_student():
     _refresh_student_cache()
     name = _current_student()
     if name is None:
         _current_student_answers["value"] = {{}}
         return
-    _current_student_answers["value"] = _student_answers_cache.get(name, {{}})
+    _current_student_answers["value"] = _student_answers(name)
+    _load_student_reviews(name)
+    _prefetch_neighbours()
 
 def _clone_widget(_widget):
     from ipywidgets import fixed as _fixed_type
@@ -615,6 +871,7 @@ def _make_display_codeexercise(template_widget, title, answer=None, enable_check
 _nav_prev = _widgets.Button(description="◀", layout=_widgets.Layout(width="50px"))
 _nav_next = _widgets.Button(description="▶", layout=_widgets.Layout(width="50px"))
 _nav_load = _widgets.Button(description="Load Student", button_style="warning", layout=_widgets.Layout(width="130px"))
+_nav_export = _widgets.Button(description="Export CSV/JSON", tooltip="Write the grades CSV and the ta_reviews files", layout=_widgets.Layout(width="140px"))
 _nav_dropdown = _widgets.Dropdown(options=[(f"{{i+1}}. {{n}}", i) for i,n in enumerate(_student_names)], value=0 if _student_names else None, layout=_widgets.Layout(width="220px"))
 _nav_label = _widgets.HTML(); _nav_status = _widgets.HTML(); _nav_debug_output = _widgets.Output()
 
@@ -627,6 +884,7 @@ def _update_nav_ui():
 def _switch_to(idx):
     if not _student_names: return
     _student_idx["value"] = idx % len(_student_names)
+    _prefetch([_current_student()])
     _update_nav_ui()
 
 def _load_and_refresh():
@@ -657,12 +915,21 @@ def _load_and_refresh_one(ex_key):
 
 def _on_nav_prev(_): _switch_to(_student_idx["value"] - 1); _load_and_refresh()
 def _on_nav_next(_): _switch_to(_student_idx["value"] + 1); _load_and_refresh()
-def _on_nav_load(_): _load_and_refresh()
+def _on_nav_load(_): _refresh_student_cache(force=True); _load_and_refresh()
+def _on_nav_export(_):
+    try:
+        _n = _export_grades()
+        _nav_status.value = f'<span style="color:green;">✅ exported {{_n}} reviews to {{_GRADES_CSV}}</span>'
+    except Exception as e:
+        _nav_status.value = f'<span style="color:red;">❌ {{e}}</span>'
+        _nav_debug_output.clear_output()
+        with _nav_debug_output: _traceback.print_exc()
 def _on_dropdown_change(change):
     if change["name"] == "value" and change["new"] is not None and change["new"] != _student_idx["value"]:
         _switch_to(change["new"])
 
 _nav_prev.on_click(_on_nav_prev); _nav_next.on_click(_on_nav_next); _nav_load.on_click(_on_nav_load)
+_nav_export.on_click(_on_nav_export)
 _nav_dropdown.observe(_on_dropdown_change, names="value")
 _refresh_student_cache(force=True)
 _update_nav_ui()
@@ -685,10 +952,12 @@ def _fmt_answer(data):
 def _comment_for(name, ex_key):
     if not name:
         return ""
+    if (name, ex_key) in _comments:
+        return _comments[(name, ex_key)]
     _answer = _current_student_answers["value"].get(ex_key, {{}})
     if isinstance(_answer, dict) and "ta_comment" in _answer:
         return _answer.get("ta_comment", "")
-    return _comments.get((name, ex_key), "")
+    return ""
 
 def _build_grading_panel(ex_key):
     ref_html = _widgets.HTML(layout=_widgets.Layout(width="49%")); stu_html = _widgets.HTML(layout=_widgets.Layout(width="49%"))
@@ -729,9 +998,8 @@ def _update_grading_panel(ex_key):
     stu_html.value = (f'<div style="border:1px solid #2196F3;border-radius:6px;padding:10px;min-height:80px;">'
                       f'<div style="font-weight:bold;color:#2196F3;margin-bottom:4px;">📘 Student ({{name or "N/A"}})</div>'
                       + _fmt_answer(stu_data) + '</div>')
-    score_input.value = _grades.get((name, ex_key), "") if name else ""
-    comment_input.value = _comment_for(name, ex_key)
-    status.value = ""
+    score_input.value, comment_input.value, _note = _review_for(name, ex_key)
+    status.value = f'<span style="color:#888;">{{_note}}</span>' if _note else ""
 
 def _build_code_score_panel(ex_key):
     score_input = _widgets.Text(placeholder="Score", layout=_widgets.Layout(width="80px"))
@@ -767,44 +1035,71 @@ def _build_code_score_panel(ex_key):
 
 def _build_code_widget_panel(template_widget, ex_key):
     container = _widgets.VBox()
-    _code_widget_panels[ex_key] = (template_widget, container, None)
-    _update_code_widget_panel(ex_key)
-    return container
+    # collapsed panels are built when they are first expanded, and refreshed only while expanded
+    accordion = _widgets.Accordion(children=[container], selected_index=None)
+    accordion.set_title(0, f"{{ex_key}}: reference and student code")
+    _code_widget_panels[ex_key] = {{
+        "template": template_widget, "container": container, "accordion": accordion,
+        "reference": None, "student": None, "initial_answer": None, "shown": None,
+    }}
+    accordion.observe(lambda change: change["new"] is not None and _update_code_widget_panel(ex_key), names="selected_index")
+    return accordion
+
+def _set_display_title(widget, title):
+    widget._title = title
+    if widget._title_html is not None:
+        widget._title_html.value = f"<b>{{title}}</b>"
+
+def _clear_display_outputs(widget):
+    if widget.output is not None:
+        widget.output.clear_output()
+    for _output in widget.outputs:
+        if hasattr(_output, "clear_display"):
+            _output.clear_display()
 
 def _update_code_widget_panel(ex_key):
     if ex_key not in _code_widget_panels:
         return
-    template_widget, container, _current_widget = _code_widget_panels[ex_key]
-    ref_widget = _make_display_codeexercise(
-        template_widget,
-        "Reference",
-        _reference_answers.get(ex_key),
-    )
+    _panel = _code_widget_panels[ex_key]
+    if _panel["accordion"].selected_index is None:
+        return
+
+    if _panel["student"] is None:
+        # the two widgets are built once and reused for all the students
+        _panel["reference"] = _make_display_codeexercise(
+            _panel["template"],
+            "Reference",
+            _reference_answers.get(ex_key),
+        )
+        _panel["student"] = _make_display_codeexercise(_panel["template"], "Student", enable_checks=True)
+        _panel["initial_answer"] = _panel["student"].answer
+        _panel["container"].children = [
+            _widgets.HBox(
+                [_panel["reference"], _panel["student"]],
+                layout=_widgets.Layout(width="100%"),
+            )
+        ]
+
     student_name = _current_student()
-    student_title = f"Student: {{student_name}}" if student_name else "Student"
     student_answer = _current_student_answers["value"].get(ex_key)
-    student_widget = _make_display_codeexercise(
-        template_widget,
-        student_title,
-        student_answer,
-        enable_checks=True,
-    )
-    container.children = [
-        _widgets.HBox(
-            [ref_widget, student_widget],
-            layout=_widgets.Layout(width="100%"),
-        )
-    ]
-    _code_widget_panels[ex_key] = (template_widget, container, student_widget)
+    if _panel["shown"] == (student_name, student_answer):
+        return
+    student_widget = _panel["student"]
+    _set_display_title(student_widget, f"Student: {{student_name}}" if student_name else "Student")
+    # resetting first gives the template code and parameters where the answer has none
+    student_widget.answer = _panel["initial_answer"]
+    if student_answer is not None:
+        student_widget.answer = student_answer
+    _clear_display_outputs(student_widget)
+    _panel["shown"] = (student_name, student_answer)
 
 def _update_code_score_panel(ex_key):
     if ex_key not in _code_score_panels: return
     score_input, comment_input, status, stu_label = _code_score_panels[ex_key]
     name = _current_student(); idx = _student_idx["value"]
     stu_label.value = f'<b>{{name or "N/A"}} ({{idx+1}}/{{len(_student_names)}})</b>'
-    score_input.value = _grades.get((name, ex_key), "") if name else ""
-    comment_input.value = _comment_for(name, ex_key)
-    status.value = ""
+    score_input.value, comment_input.value, _note = _review_for(name, ex_key)
+    status.value = f'<span style="color:#888;">{{_note}}</span>' if _note else ""
 
 def _update_all_grading_panels():
     for k in list(_grading_panels.keys()): _update_grading_panel(k)
@@ -817,7 +1112,7 @@ print("Run all cells, then click Load Student.")
 
     nav_src = '''# Student Navigation
 display(_widgets.VBox([
-    _widgets.HBox([_nav_prev, _nav_dropdown, _nav_next, _nav_load, _nav_label, _nav_status],
+    _widgets.HBox([_nav_prev, _nav_dropdown, _nav_next, _nav_load, _nav_export, _nav_label, _nav_status],
                   layout=_widgets.Layout(border="2px solid #FF9800", padding="8px", border_radius="8px", margin="8px 0", justify_content="center")),
     _nav_debug_output
 ]))
@@ -869,15 +1164,27 @@ def add_summary(cells, exercise_order):
     cells.append(code_cell(f'''_EXERCISE_ORDER = {repr(exercise_order)}
 
 import pandas as _pd
-if _os.path.exists(_GRADES_CSV):
-    _df = _pd.read_csv(_GRADES_CSV)
+_index_answers()
+_df = _pd.DataFrame(_effective_reviews(), columns=["student", "exercise", "score", "comment", "answer"])
+if len(_df):
     _pivot = _df.pivot(index="student", columns="exercise", values="score")
     _ordered = [ex for ex in _EXERCISE_ORDER if ex in _pivot.columns]
     _extras = [ex for ex in _pivot.columns if ex not in _ordered]
     display(_pivot.reindex(columns=_ordered + _extras))
-    print(f"CSV path: {{_os.path.abspath(_GRADES_CSV)}}")
+    print(f"Database: {{_os.path.abspath(_GRADES_DB)}} (use Export CSV/JSON to write {{_GRADES_CSV}})")
 else:
-    print("No grades recorded yet.")'''))
+    print("No grades recorded yet.")
+
+# identical answers (up to formatting and comments), with the review they share if there is one
+with _closing(_grades_db()) as _db:
+    _clusters = _pd.read_sql_query(
+        "SELECT h.exercise, count(*) AS answers, group_concat(h.student, ', ') AS students, r.score, r.student AS reviewed "
+        "FROM answer_hashes h LEFT JOIN answer_reviews r ON h.exercise = r.exercise AND h.hash = r.hash "
+        "GROUP BY h.exercise, h.hash HAVING count(*) > 1 ORDER BY h.exercise, answers DESC",
+        _db,
+    )
+if len(_clusters):
+    display(_clusters)'''))
 
 
 def main():
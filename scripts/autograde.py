@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# Runs the checks of the code exercises of a module on all the student submissions, and writes
+# a grades CSV that the grading view created by apply_grading_view.py can start from.
+
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import linecache
+import os
+import re
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from apply_grading_view import answer_hash, detect_module_prefix, detect_submissions_dir
+
+# widgets with checks, built once in each worker process: {exercise key: CodeExercise},
+# and the template answers they start from
+_checked_widgets = {}
+_template_answers = {}
+_check_timeout = {"value": None}
+# (cell number, error) of the notebook cells that could not be run
+_failed_cells = []
+
+
+def notebook_code(nb):
+    # code cells up to the last one that registers a check, without IPython magics (also when
+    # they are written as calls to get_ipython(), which does not exist outside IPython)
+    cells = ["".join(c.get("source", [])) for c in nb["cells"] if c["cell_type"] == "code"]
+    last = max((i for i, src in enumerate(cells) if "add_check(" in src), default=-1)
+    return [
+        "\n".join(line for line in src.split("\n") if not line.lstrip().startswith(("%", "!", "get_ipython()")))
+        for src in cells[: last + 1]
+        if not src.lstrip().startswith("%%")
+    ]
+
+
+def load_checked_widgets(notebook):
+    from scwidgets.exercise import CodeExercise
+
+    namespace = {"__name__": "__main__", "display": lambda *args, **kwargs: None}
+    failed = []
+    for i, src in enumerate(notebook_code(json.loads(Path(notebook).read_text()))):
+        # CodeExercise reads the source of the exercise functions with inspect, which finds
+        # the code of each cell in linecache, as it does in IPython
+        filename = f"<{notebook} cell {i}>"
+        linecache.cache[filename] = (len(src), None, src.splitlines(True), filename)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                exec(compile(src, filename, "exec"), namespace)
+        except Exception as e:
+            # cells that cannot run headless are skipped; the checks are defined anyway if they don't need them
+            failed.append((i, f"{type(e).__name__}: {e}"))
+    widgets = {}
+    for value in namespace.values():
+        if (
+            isinstance(value, CodeExercise)
+            and value.exercise_key is not None
+            and value.check_registry is not None
+            and value.checks
+        ):
+            widgets[value.exercise_key] = value
+    return widgets, failed
+
+
+def _limit_memory(megabytes):
+    import resource
+
+    # the limit is on the total address space, so it is set on top of what the notebook already uses
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        return
+    limit = current + megabytes * 2**20
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+@contextlib.contextmanager
+def _time_limit(seconds):
+    def _raise(signum, frame):
+        raise TimeoutError(f"the check took longer than {seconds} s")
+
+    previous = signal.signal(signal.SIGALRM, _raise)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _init_worker(notebook, timeout, memory_limit):
+    os.environ.setdefault("MPLBACKEND", "agg")
+    # the notebooks read their data files with paths relative to their folder, and import
+    # iam_tools from there, as they do when they run in jupyter
+    notebook = Path(notebook).resolve()
+    os.chdir(notebook.parent)
+    sys.path.insert(0, str(notebook.parent))
+    widgets, failed = load_checked_widgets(str(notebook))
+    _checked_widgets.update(widgets)
+    _failed_cells.extend(failed)
+    _template_answers.update({key: widget.answer for key, widget in widgets.items()})
+    _check_timeout["value"] = timeout
+    if memory_limit:
+        _limit_memory(memory_limit)
+
+
+def _short_message(text, limit=300):
+    text = re.sub(r"\s+", " ", str(text)).strip()
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def setup_report():
+    """
+    :return: {exercise key: number of checks} for the exercises whose checks were loaded by
+        the worker, and the (cell number, error) of the notebook cells that failed
+    """
+    return {key: len(widget.checks) for key, widget in _checked_widgets.items()}, list(_failed_cells)
+
+
+def grade_submission(path, known=frozenset()):
+    """
+    Runs the checks of every code exercise on the answers in a submission file.
+
+    The checks of an exercise can call the code of the exercises defined before it (e.g. the
+    fingerprints of exercise 5 in the PCA of exercise 8), so their result is identified by the
+    hashes (see ``answer_hash``) of the code of the exercise and of all the ones before it.
+
+    :param known: the identifiers of the results that are already known, whose checks are skipped
+    :return: a list of (exercise key, result identifier, (checks passed, checks run, comment)),
+        with None instead of the result for the checks that were skipped, or an error message
+        if the submission cannot be read
+    """
+    try:
+        with open(path) as f:
+            answers = json.load(f)
+        if not isinstance(answers, dict):
+            raise ValueError("the file does not contain a JSON object")
+    except (OSError, ValueError) as e:
+        return f"could not read the submission: {_short_message(e)}"
+    # all the answers are loaded before running any check, since checks call the code of other exercises
+    answered, hashes, result_ids = set(), [], {}
+    for key, widget in _checked_widgets.items():
+        widget.answer = _template_answers[key]
+        answer = answers.get(key)
+        if isinstance(answer, dict) and answer.get("code"):
+            widget.answer = {"code": answer["code"], "parameters_panel": None}
+            answered.add(key)
+        hashes.append(answer_hash(widget.answer))
+        result_ids[key] = key + ":" + hashlib.sha256(json.dumps(hashes).encode()).hexdigest()[:24]
+
+    results = []
+    for key, widget in _checked_widgets.items():
+        checks = widget.checks
+        if key not in answered:
+            results.append((key, None, (0, len(checks), "no answer")))
+            continue
+        if result_ids[key] in known:
+            results.append((key, result_ids[key], None))
+            continue
+        passed, failures = 0, []
+        for check in checks:
+            try:
+                with _time_limit(_check_timeout["value"]), contextlib.redirect_stdout(io.StringIO()):
+                    result = check.check_function()
+                if result.successful:
+                    passed += 1
+                else:
+                    failures.append(result.message())
+            except Exception as e:
+                # includes syntax errors, timeouts and MemoryError from the memory limit
+                failures.append(f"{type(e).__name__}: {e}")
+        comment = f"{passed}/{len(checks)} checks passed"
+        if failures:
+            comment += "; " + _short_message(failures[0])
+        results.append((key, result_ids[key], (passed, len(checks), comment)))
+    return results
+
+
+def _run_pool(names, paths, jobs, initargs, results, checked, progress, deadline=None):
+    # at most one submission per worker is in flight, so that a worker that dies (e.g. killed for
+    # using too much memory) can only take down the submissions that were running with it
+    queue, crashed = list(names), []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=initargs) as pool:
+        running, started = {}, {}
+        while queue or running:
+            while queue and len(running) < jobs:
+                name = queue.pop(0)
+                future = pool.submit(grade_submission, paths[name], frozenset(checked))
+                running[future], started[future] = name, time.monotonic()
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.0, min(started[future] for future in running) + deadline - time.monotonic())
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # the time limit of the checks runs in the worker, and an answer that catches
+                # the TimeoutError can keep it busy forever: the workers are killed, and the
+                # other submissions that were running are graded again in a new pool
+                late = min(running, key=started.get)
+                name = running.pop(late)
+                results[name] = f"timeout: the checks took longer than {deadline:.0f} s"
+                progress(name, results[name])
+                for process in list(pool._processes.values()):
+                    process.terminate()
+                queue[:0] = running.values()
+                break
+            for future in done:
+                name = running.pop(future)
+                try:
+                    graded = future.result()
+                except BrokenProcessPool:
+                    crashed.append(name)
+                    continue
+                except Exception as e:
+                    graded = f"grading failed: {_short_message(f'{type(e).__name__}: {e}')}"
+                if isinstance(graded, str):
+                    results[name] = graded
+                    progress(name, graded)
+                    continue
+                # identical answers are only checked once, and take the result of the first one
+                checked.update((result_id, result) for _, result_id, result in graded if result is not None and result_id)
+                results[name] = [(key, *(checked[result_id] if result is None else result)) for key, result_id, result in graded]
+                progress(name, results[name])
+            if crashed:
+                crashed.extend(running.values())
+                break
+    return queue, crashed
+
+
+def grade_all(paths, jobs, initargs, checked=None, progress=lambda name, result: None, deadline=None):
+    """
+    Grades all the submissions in a process pool.
+
+    When a worker dies, the pool is restarted for the remaining submissions, and the ones that
+    were running at the time are graded again one at a time, to find the one responsible.
+
+    :param paths: {student name: submission file}
+    :param checked: {result identifier: result} of the checks that have already been run,
+        updated with the new results
+    :param deadline: time limit for grading one submission, in seconds, after which its worker
+        is killed and the submission gets a timeout
+    :return: {student name: [(exercise key, checks passed, checks run, comment)], or an error message}
+    """
+    results, suspects = {}, []
+    checked = {} if checked is None else checked
+    queue = sorted(paths)
+    while queue:
+        queue, crashed = _run_pool(queue, paths, jobs, initargs, results, checked, progress, deadline)
+        suspects.extend(crashed)
+    for name in sorted(suspects):
+        _, crashed = _run_pool([name], paths, 1, initargs, results, checked, progress, deadline)
+        if crashed:
+            results[name] = "the grading process crashed"
+    return results
+
+
+def write_grades(path, results, points):
+    keys = {}
+    for result in results.values():
+        if not isinstance(result, str):
+            keys.update((r[0], None) for r in result)
+    with open(path, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=["student", "exercise", "score", "comment"])
+        w.writeheader()
+        for student in sorted(results):
+            if isinstance(results[student], str):
+                for key in keys:
+                    w.writerow({"student": student, "exercise": key, "score": "", "comment": f"autograder: {results[student]}"})
+                continue
+            for key, passed, total, comment in results[student]:
+                w.writerow({
+                    "student": student,
+                    "exercise": key,
+                    "score": f"{points * passed / total:.3g}" if total else "",
+                    "comment": f"autograder: {comment}",
+                })
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Headless autograder for the code exercises of a module")
+    ap.add_argument("notebook", help="module notebook that defines the checks")
+    ap.add_argument("--module-prefix", default=None, help="prefix of the submission files (e.g. module_01)")
+    ap.add_argument("--submissions-dir", default=None, help="directory where student submission JSON files are located")
+    ap.add_argument("--grades-csv", default=None, help="CSV file to write the grades to")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    ap.add_argument("--timeout", type=float, default=60.0, help="time limit for each check, in seconds")
+    ap.add_argument("--memory-limit", type=int, default=4096, help="memory limit for the checks of each worker, in MB (0: no limit)")
+    ap.add_argument("--points", type=float, default=1.0, help="score of an exercise that passes all its checks")
+    ap.add_argument("--overwrite", action="store_true", help="overwrite an existing grades CSV")
+    ap.add_argument("--allow-failed-cells", action="store_true", help="grade even if some code cells of the notebook fail to run")
+    ap.add_argument("--no-cache", action="store_true", help="check all the answers again, ignoring the results of previous runs")
+    args = ap.parse_args()
+
+    src_path = Path(args.notebook)
+    if not src_path.exists():
+        raise SystemExit(f"Notebook not found: {src_path}")
+    nb = json.loads(src_path.read_text())
+    module_prefix = args.module_prefix or detect_module_prefix(nb)
+    if not module_prefix:
+        raise SystemExit("Could not detect module_prefix; pass --module-prefix")
+    submissions_dir = args.submissions_dir or detect_submissions_dir(nb, module_prefix)
+    grades_csv = args.grades_csv or f"grades_{module_prefix}.csv"
+    if os.path.exists(grades_csv) and not args.overwrite:
+        raise SystemExit(f"{grades_csv} already exists; pass --overwrite or --grades-csv")
+
+    paths = {
+        p.name[len(module_prefix) + 1 : -len(".json")]: str(p.resolve())
+        for p in sorted(Path(submissions_dir).glob(f"{module_prefix}-*.json"))
+    }
+    if not paths:
+        raise SystemExit(f"No submissions found in {submissions_dir}")
+    print(f"Grading {len(paths)} submissions with {args.jobs} workers")
+
+    done = []
+
+    def progress(name, result):
+        done.append(name)
+        if isinstance(result, str):
+            print(f"[{len(done)}/{len(paths)}] {name}: {result}", flush=True)
+            return
+        passed = sum(r[1] for r in result)
+        total = sum(r[2] for r in result)
+        print(f"[{len(done)}/{len(paths)}] {name}: {passed}/{total} checks passed", flush=True)
+
+    # results of previous runs, by result identifier, valid as long as the checks do not change
+    cache_path = os.path.splitext(grades_csv)[0] + ".checks.json"
+    checks_hash = hashlib.sha256("\n".join(notebook_code(nb)).encode()).hexdigest()
+    checked = {}
+    if os.path.exists(cache_path) and not args.no_cache:
+        with open(cache_path) as f:
+            cache = json.load(f)
+        if cache.get("notebook") == checks_hash:
+            checked = {result_id: tuple(result) for result_id, result in cache["results"].items()}
+    n_cached = len(checked)
+
+    # the notebook is loaded once before grading, to report the cells that cannot run headless:
+    # the exercises they define, or whose checks depend on them, are missing from the grades
+    initargs = (str(src_path), args.timeout, args.memory_limit)
+    setup_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=initargs) as pool:
+        exercises, failed = pool.submit(setup_report).result()
+    setup_time = time.perf_counter() - setup_start
+    for cell, error in failed:
+        print(f"WARNING: code cell {cell} of {src_path} failed: {_short_message(error)}", file=sys.stderr)
+    if not exercises:
+        raise SystemExit("No checked code exercises could be loaded from the notebook")
+    print(f"Checks loaded for {len(exercises)} exercises: {', '.join(exercises)}")
+    if failed and not args.allow_failed_cells:
+        raise SystemExit(f"{len(failed)} code cells of the notebook failed; fix them, or pass --allow-failed-cells "
+                         "if the exercises above are all the ones that should be graded")
+
+    # a submission gets the time of all its checks, plus that of loading the notebook in a new
+    # worker, and a margin
+    deadline = args.timeout * sum(exercises.values()) + 2 * setup_time + 30 if args.timeout else None
+    start = time.perf_counter()
+    results = grade_all(paths, args.jobs, initargs, checked, progress, deadline)
+    write_grades(grades_csv, results, args.points)
+    with open(cache_path + ".tmp", "w") as f:
+        json.dump({"notebook": checks_hash, "results": checked}, f)
+    os.replace(cache_path + ".tmp", cache_path)
+    n_answers = sum(len(r) for r in results.values() if isinstance(r, list))
+    print(f"Graded {len(results)} submissions in {time.perf_counter() - start:.0f} s "
+          f"({len(checked) - n_cached} distinct answers checked for {n_answers} exercises)")
+    print(f"Grades: {grades_csv} (imported by the grading view when it creates its database)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# Micro-benchmarks for the computational kernels behind the exercises of each module, timed for
+# increasing system sizes. The results are written as JSON together with a description of the
+# machine, and can be compared with a previous run to flag regressions.
+#
+# The iam_tools routines that the notebooks use, and the vectorized kernels of
+# reference_kernels.py, are always benchmarked. The reference answers of the exercises, as
+# the students are expected to write them, are not part of this repository: pass
+# --reference-dir with the reference answers used by apply_grading_view.py to benchmark them
+# as well.
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from pathlib import Path
+
+import numpy as np
+
+from apply_grading_view import detect_module_prefix
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def _fcc_aluminum(nrep, vacancy=False):
+    from ase.build import bulk
+
+    structure = bulk("Al", "fcc", a=4.05, cubic=True).repeat(nrep)
+    if vacancy:
+        del structure[0]
+    return structure
+
+
+def _materials(n):
+    from iam_tools.structures import load_structures
+
+    # the dataset is repeated to reach sizes larger than the number of structures it contains
+    structures = load_structures(str(ROOT / "data" / "mp_elastic.extxyz"))[:]
+    return (structures * (n // len(structures) + 1))[:n]
+
+
+def _random_walk(n_frames, n_atoms=108, seed=0):
+    steps = np.random.default_rng(seed).normal(scale=0.1, size=(n_frames, n_atoms, 3))
+    return np.cumsum(steps, axis=0)
+
+
+def _two_body_initial(n_systems):
+    from reference_kernels import G
+
+    # circular orbits of the moon around the earth, with a spread of masses
+    m1 = np.linspace(7.3e22, 7.3e23, n_systems)
+    m2 = np.full(n_systems, 6.0e24)
+    x1 = np.tile([3.84e8, 0.0], (n_systems, 1))
+    v1 = np.tile([0.0, 1.0], (n_systems, 1)) * np.sqrt(G * m2 / 3.84e8)[:, np.newaxis]
+    return m1, m2, x1, -x1 * (m1 / m2)[:, np.newaxis], v1, -v1 * (m1 / m2)[:, np.newaxis]
+
+
+def _count_reflections(reciprocal, g_max):
+    from iam_tools.diffraction import reflection_cache, reflections
+
+    count = len(reflections(reciprocal, g_max)[0])
+    # the first timed call should find the cache empty, as it does in the notebook
+    reflection_cache.clear()
+    return count
+
+
+# Each setup function takes the size and returns the call to time, and the number N of atoms,
+# reflections, frames... that it works on, against which the scaling is fitted. The iam_tools
+# caches (e.g. of the reciprocal lattice vectors) are kept, as in the notebooks, so the first
+# call is reported separately from the following ones.
+
+
+def setup_diffraction(resolution):
+    from iam_tools.diffraction import diffraction_peaks
+
+    structure = _fcc_aluminum(1)
+    reciprocal = 2 * np.pi * structure.cell.reciprocal().array
+    form_factors = np.full(len(structure), 13.0)
+    call = lambda: diffraction_peaks(reciprocal, structure.positions, form_factors, 1 / resolution)
+    return call, _count_reflections(reciprocal, 4 * np.pi * resolution)
+
+
+def setup_eam_forces(nrep):
+    from ase.calculators.calculator import all_changes
+
+    from iam_tools.eam import EAM
+
+    structure = _fcc_aluminum(nrep)
+    structure.rattle(0.05, seed=0)
+    calc = EAM(potential=str(ROOT / "data" / "Al99.eam.alloy"))
+    return lambda: calc.calculate(structure, ["energy", "forces"], all_changes), len(structure)
+
+
+def setup_eam_md(nrep):
+    from ase import units
+    from ase.md.velocitydistribution import MaxwellBoltzmannDistribution
+    from ase.md.verlet import VelocityVerlet
+
+    from iam_tools.eam import EAM
+
+    structure = _fcc_aluminum(nrep)
+    structure.calc = EAM(potential=str(ROOT / "data" / "Al99.eam.alloy"))
+    MaxwellBoltzmannDistribution(structure, temperature_K=600, rng=np.random.default_rng(0))
+    integrator = VelocityVerlet(structure, 2 * units.fs)
+    return lambda: integrator.run(20), len(structure)
+
+
+def setup_eam_relax(nrep):
+    from ase.optimize import LBFGS
+
+    from iam_tools.eam import EAM
+
+    vacancy = _fcc_aluminum(nrep, vacancy=True)
+    vacancy.rattle(0.02, seed=0)
+
+    def relax():
+        structure = vacancy.copy()
+        structure.calc = EAM(potential=str(ROOT / "data" / "Al99.eam.alloy"))
+        LBFGS(structure, logfile=None).run(fmax=0.01)
+
+    return relax, len(vacancy)
+
+
+def setup_msd(n_frames):
+    from iam_tools.msd import msd_fft
+
+    positions = _random_walk(n_frames)
+    return lambda: msd_fft(positions), n_frames
+
+
+def setup_polynomial(n_structures):
+    from reference_kernels import composition, polynomial
+
+    structures = _materials(n_structures)
+    return lambda: polynomial(composition(structures), 3), n_structures
+
+
+def setup_pca(n_structures):
+    from iam_tools.pca import StreamingPCA
+    from reference_kernels import composition, polynomial
+
+    features = polynomial(composition(_materials(n_structures)), 3)
+    return lambda: StreamingPCA(4).partial_fit(features).transform(features), n_structures
+
+
+def setup_two_body(n_systems):
+    from reference_kernels import simulate_ensemble, verlet_update_batch
+
+    initial = _two_body_initial(n_systems)
+    return lambda: simulate_ensemble(verlet_update_batch, *initial, dt=3600.0, num=1000), n_systems
+
+
+# (name, module, size parameter, sizes, setup, what N counts)
+KERNELS = [
+    ("diffraction.diffraction_peaks", "02", "1/wavelength", [1, 2, 4], setup_diffraction, "reflections"),
+    ("eam.EAM forces", "05", "nrep", [2, 4, 6], setup_eam_forces, "atoms"),
+    ("eam.EAM velocity Verlet, 20 steps", "06", "nrep", [2, 3, 4], setup_eam_md, "atoms"),
+    ("eam.EAM vacancy relaxation", "05", "nrep", [2, 3, 4], setup_eam_relax, "atoms"),
+    ("msd.msd_fft", "06", "n_frames", [1000, 4000, 16000], setup_msd, "frames"),
+    ("reference_kernels.polynomial", "07", "n_structures", [300, 1200, 4800], setup_polynomial, "structures"),
+    ("pca.StreamingPCA", "07", "n_structures", [300, 1200, 4800], setup_pca, "structures"),
+    ("reference_kernels.simulate_ensemble, 1000 steps", "06", "n_systems", [1, 100, 10000], setup_two_body, "systems"),
+]
+
+
+def reference_function(name, reference_dir):
+    """
+    The reference solution of the exercise whose template is the function ``name``, built from
+    the signature of the template in the editable notebook and the code of the reference answer.
+
+    :return: the function, or None if there is no reference answer for it
+    """
+    for path in sorted((ROOT / "editable").glob("*.ipynb")):
+        nb = json.loads(path.read_text())
+        src = "\n".join("".join(c["source"]) for c in nb["cells"] if c["cell_type"] == "code")
+        signature = re.search(rf"^def {name}\((.*?)\):", src, re.M | re.S)
+        exercise = re.search(rf"CodeExercise\(\s*code\s*=\s*{name}\s*,(?:(?!CodeExercise\().)*?key\s*=\s*\"([^\"]+)\"", src, re.S)
+        if signature is None or exercise is None:
+            continue
+        answers = Path(reference_dir) / f"{detect_module_prefix(nb)}-referenceanswers.json"
+        if not answers.exists():
+            return None
+        code = json.loads(answers.read_text()).get(exercise.group(1), {}).get("code")
+        if not code:
+            return None
+        namespace = {}
+        exec(f"def {name}({signature.group(1)}):\n{textwrap.indent(code, '    ')}\n", namespace)
+        return namespace[name]
+    return None
+
+
+def reference_setups(reference_dir):
+    # the exercise functions read and write files relative to the notebook folder, so they are
+    # run in a scratch folder that links the data
+    functions = {
+        name: reference_function(name, reference_dir)
+        for name in ("total_LJ_bulk", "diffraction_peaks", "aluminum_MD", "vacancy_relax",
+                     "compute_msd", "descriptor_poly", "PCA_analysis", "verlet_update")
+    }
+
+    def setup_total_lj(r_cut):
+        # the structure is fixed, so the only size is the cutoff
+        return lambda: functions["total_LJ_bulk"](r_cut), r_cut
+
+    def setup_peaks(resolution):
+        basis = np.array([[0.0, 0.0], [0.5, 0.5]])
+        reciprocal = 2 * np.pi * np.eye(2)
+        call = lambda: functions["diffraction_peaks"](basis, np.array([10.0, 30.0]), reciprocal[0], reciprocal[1], 1 / resolution)
+        return call, _count_reflections(reciprocal, 4 * np.pi * resolution)
+
+    def setup_aluminum_md(n_steps):
+        # 1 ps of dynamics
+        return lambda: functions["aluminum_MD"](1000 / n_steps), n_steps
+
+    def setup_vacancy(nrep):
+        return lambda: functions["vacancy_relax"](nrep), 4 * nrep**3 - 1
+
+    def setup_compute_msd(n_frames):
+        import ase
+        import ase.io
+
+        filename = f"benchmark_msd_{n_frames}.extxyz"
+        box = 20.0
+        ase.io.write(filename, [
+            ase.Atoms("Al" * len(frame), positions=frame % box, cell=[box] * 3, pbc=True)
+            for frame in _random_walk(n_frames)
+        ])
+        return lambda: functions["compute_msd"](filename), n_frames
+
+    def setup_descriptor(n_structures):
+        structures = _materials(n_structures)
+        return lambda: functions["descriptor_poly"](structures, 3), n_structures
+
+    def setup_pca_analysis(n_structures):
+        from reference_kernels import composition
+
+        structures = _materials(n_structures)
+        return lambda: functions["PCA_analysis"](structures, lambda s: composition(s).toarray(), 0.5), n_structures
+
+    def setup_simulate(num):
+        # the loop of ``simulate`` in the molecular dynamics notebook, one system at a time
+        m1, m2, x1, x2, v1, v2 = (value[0] for value in _two_body_initial(1))
+
+        def simulate():
+            r1, r2, u1, u2 = x1, x2, v1, v2
+            for _ in range(num):
+                r1, r2, u1, u2 = functions["verlet_update"](m1, m2, r1, r2, u1, u2, 3600.0)
+
+        return simulate, num
+
+    cases = [
+        ("total_LJ_bulk", "04", "r_cut", [1.5, 2.0, 2.8], setup_total_lj, "r_cut", "total_LJ_bulk"),
+        ("diffraction_peaks", "02", "1/wavelength", [1, 2, 4], setup_peaks, "reflections", "diffraction_peaks"),
+        ("aluminum_MD", "06", "n_steps", [100, 200, 500], setup_aluminum_md, "steps", "aluminum_MD"),
+        ("vacancy_relax", "05", "nrep", [2, 3, 4], setup_vacancy, "atoms", "vacancy_relax"),
+        ("compute_msd", "06", "n_frames", [100, 400, 1600], setup_compute_msd, "frames", "compute_msd"),
+        ("descriptor_poly", "07", "n_structures", [300, 1200, 4800], setup_descriptor, "structures", "descriptor_poly"),
+        ("PCA_analysis", "07", "n_structures", [300, 1200, 4800], setup_pca_analysis, "structures", "PCA_analysis"),
+        ("simulate(verlet_update)", "06", "n_steps", [1000, 4000, 16000], setup_simulate, "steps", "verlet_update"),
+    ]
+    missing = sorted({case[6] for case in cases if functions[case[6]] is None})
+    return [case[:6] for case in cases if functions[case[6]] is not None], missing
+
+
+def measure(call, repeat=3, min_time=0.5):
+    """
+    Times a call: once on its own, as the first call may fill caches, then repeatedly until
+    it has run ``repeat`` times or for ``min_time`` seconds.
+
+    :return: (time of the first call, median time of the following calls, number of calls)
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        call()
+        first = time.perf_counter() - start
+        times = []
+        while len(times) < repeat and (not times or sum(times) < min_time):
+            start = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - start)
+    return first, statistics.median(times), len(times) + 1
+
+
+def machine_info():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "commit": commit,
+    }
+
+
+def scaling_exponents(results):
+    """
+    Slope of log(time) against log(N), with N the number of atoms, frames... of each run:
+    ~1 for a linear kernel, ~2 for a quadratic one. N is not the size parameter, e.g. the
+    number of atoms grows as nrep^3.
+
+    :return: {benchmark: (what N counts, exponent)}
+    """
+    exponents = {}
+    for name in dict.fromkeys(r["benchmark"] for r in results):
+        runs = [r for r in results if r["benchmark"] == name and r["time"] > 0]
+        points = [(r["n"], r["time"]) for r in runs]
+        if len({n for n, _ in points}) > 1:
+            counts, times = np.log(np.array(points, dtype=float)).T
+            exponents[name] = (runs[0]["variable"], round(float(np.polyfit(counts, times, 1)[0]), 2))
+    return exponents
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: {(benchmark, size): (ratio to the baseline time, flag)}, with flag "REGRESSION" for
+        runs slower than the baseline by more than threshold, "faster" for runs faster by as much
+    """
+    reference = {(r["benchmark"], r["size"]): r["time"] for r in baseline["results"]}
+    comparison = {}
+    for r in results:
+        key = (r["benchmark"], r["size"])
+        if key not in reference or reference[key] <= 0:
+            continue
+        ratio = r["time"] / reference[key]
+        # differences below 0.1 ms are timer noise
+        significant = abs(r["time"] - reference[key]) > 1e-4
+        flag = ""
+        if significant and ratio > 1 + threshold:
+            flag = "REGRESSION"
+        elif significant and ratio < 1 / (1 + threshold):
+            flag = "faster"
+        comparison[key] = (ratio, flag)
+    return comparison
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Micro-benchmarks for the computational kernels of the modules")
+    ap.add_argument("--only", nargs="*", default=None, help="only run the benchmarks whose name contains one of these strings")
+    ap.add_argument("--quick", action="store_true", help="only run the two smallest sizes of each benchmark")
+    ap.add_argument("--reference-dir", default=None, help="directory with the reference answers, to benchmark the exercise solutions")
+    ap.add_argument("--repeat", type=int, default=3, help="maximum number of timed calls after the first one")
+    ap.add_argument("--min-time", type=float, default=0.5, help="stop repeating a call after this many seconds")
+    ap.add_argument("--output", default="benchmark.json", help="JSON file to write the results to")
+    ap.add_argument("--baseline", default=None, help="JSON file of a previous run to compare with")
+    ap.add_argument("--threshold", type=float, default=0.2, help="relative slowdown that is flagged as a regression")
+    args = ap.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output)
+
+    cases = list(KERNELS)
+    scratch = tempfile.TemporaryDirectory(prefix="iam-benchmark-")
+    if args.reference_dir:
+        reference_cases, missing = reference_setups(os.path.abspath(args.reference_dir))
+        cases += reference_cases
+        if missing:
+            print(f"No reference answer for: {', '.join(missing)}")
+        os.symlink(ROOT / "data", Path(scratch.name) / "data")
+    if args.only:
+        cases = [case for case in cases if any(pattern in case[0] for pattern in args.only)]
+    if not cases:
+        raise SystemExit("No benchmark selected")
+
+    machine = machine_info()
+    if baseline is not None:
+        changed = [k for k in ("host", "processor", "cpu_count", "python", "numpy") if baseline["machine"].get(k) != machine[k]]
+        if changed:
+            print(f"Warning: the baseline was recorded with a different {', '.join(changed)}")
+
+    results = []
+    cwd = os.getcwd()
+    os.chdir(scratch.name)
+    try:
+        for name, module, parameter, sizes, setup, variable in cases:
+            for size in sizes[:2] if args.quick else sizes:
+                call, n = setup(size)
+                first, median, calls = measure(call, args.repeat, args.min_time)
+                results.append({
+                    "benchmark": name, "module": module, "parameter": parameter, "size": size,
+                    "n": n, "variable": variable, "time": median, "first": first, "calls": calls,
+                })
+                print(f"{name:45s} {parameter} = {size:<8g} {median * 1e3:10.2f} ms  (first call {first * 1e3:.2f} ms, {n:g} {variable})", flush=True)
+    finally:
+        os.chdir(cwd)
+        scratch.cleanup()
+
+    exponents = scaling_exponents(results)
+    print("\nScaling (time ~ N^k):")
+    for name, (variable, exponent) in exponents.items():
+        print(f"  {name:45s} k = {exponent:5.2f}  (N = {variable})")
+
+    regressions = []
+    if baseline is not None:
+        comparison = compare(results, baseline, args.threshold)
+        print(f"\nCompared with {args.baseline} ({baseline['machine'].get('date')}, commit {baseline['machine'].get('commit')}):")
+        for r in results:
+            key = (r["benchmark"], r["size"])
+            if key in comparison:
+                ratio, flag = comparison[key]
+                print(f"  {r['benchmark']:45s} {r['parameter']} = {r['size']:<8g} x{ratio:6.2f}  {flag}")
+                if flag == "REGRESSION":
+                    regressions.append(key)
+
+    with open(output, "w") as f:
+        scaling = {name: {"n": variable, "exponent": exponent} for name, (variable, exponent) in exponents.items()}
+        json.dump({"machine": machine, "results": results, "scaling": scaling}, f, indent=1)
+    print(f"\nResults: {output}")
+    if regressions:
+        raise SystemExit(f"{len(regressions)} regressions slower than the baseline by more than {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Exports the notebooks in editable/ to the "locked" copies in the main folder: outputs and
+# cells tagged "solution" are removed, and all the cells are made read-only and undeletable.
+# Notebooks whose source and locked copy have not changed since the last export are skipped
+# without being parsed, and a locked copy is only rewritten when its content changes.
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+CACHE_FILE = ROOT / "editable" / ".iam_cache" / "export_clean_notebooks.json"
+# cell metadata that only describes the state of the outputs
+OUTPUT_METADATA = ("collapsed", "scrolled", "execution")
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path):
+    try:
+        return sha256(path.read_bytes())
+    except FileNotFoundError:
+        return None
+
+
+def cell_hash(cell):
+    return sha256(json.dumps(cell, sort_keys=True).encode())[:16]
+
+
+def clean_cell(cell):
+    cell = dict(cell)
+    metadata = {k: v for k, v in cell.get("metadata", {}).items() if k not in OUTPUT_METADATA}
+    metadata.update(editable=False, deletable=False)
+    cell["metadata"] = metadata
+    if cell["cell_type"] == "code":
+        cell["execution_count"] = None
+        cell["outputs"] = []
+    return cell
+
+
+def clean_notebook(nb):
+    nb = dict(nb)
+    nb["cells"] = [
+        clean_cell(cell) for cell in nb["cells"] if "solution" not in cell.get("metadata", {}).get("tags", [])
+    ]
+    return nb
+
+
+def export_notebook(src, dst, write=True):
+    """
+    Writes the locked copy of a notebook, if it differs from the existing one.
+
+    :return: (whether dst changed, content hash of dst, content hashes of the source cells)
+    """
+    nb = json.loads(src.read_text())
+    out = json.dumps(clean_notebook(nb), indent=1).encode()
+    changed = file_hash(dst) != sha256(out)
+    if changed and write:
+        # written to a temporary file first, so an interrupted export never leaves a truncated notebook
+        tmp = dst.with_name(dst.name + ".tmp")
+        tmp.write_bytes(out)
+        os.replace(tmp, dst)
+    return changed, sha256(out), [cell_hash(cell) for cell in nb["cells"]]
+
+
+def _export(args):
+    return export_notebook(*args)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Export the notebooks in editable/ to the locked notebooks in the main folder")
+    ap.add_argument("notebooks", nargs="*", help="notebooks to export (default: all the notebooks in editable/)")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    ap.add_argument("--check", action="store_true", help="only list the locked notebooks that are out of date, and fail if there are any")
+    ap.add_argument("--force", action="store_true", help="ignore the cache of the previous exports")
+    args = ap.parse_args()
+
+    sources = [Path(n).resolve() for n in args.notebooks] or sorted((ROOT / "editable").glob("*.ipynb"))
+    cache = {}
+    if CACHE_FILE.exists() and not args.force:
+        cache = json.loads(CACHE_FILE.read_text())
+
+    # content hashes of the source and of the locked copy: if both are the ones of the last
+    # export, there is nothing to do
+    todo, hashes = [], {}
+    for src in sources:
+        dst = ROOT / src.name
+        hashes[src.name] = (file_hash(src), file_hash(dst))
+        entry = cache.get(src.name, {})
+        if (entry.get("source"), entry.get("target")) != hashes[src.name]:
+            todo.append((src, dst, not args.check))
+
+    if args.jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(todo))) as pool:
+            results = list(pool.map(_export, todo))
+    else:
+        results = [_export(job) for job in todo]
+
+    stale = []
+    for (src, dst, _), (changed, target, cells) in zip(todo, results):
+        previous = set(cache.get(src.name, {}).get("cells", []))
+        if changed:
+            stale.append(dst.name)
+            n_changed = sum(h not in previous for h in cells) if previous else len(cells)
+            print(f"{'out of date' if args.check else 'exported'}: {dst.name} ({n_changed}/{len(cells)} cells changed)")
+        cache[src.name] = {"source": hashes[src.name][0], "target": target, "cells": cells}
+
+    if args.check:
+        # a check leaves the tree untouched, cache included
+        print(f"{len(sources) - len(stale)} of {len(sources)} locked notebooks up to date")
+        if stale:
+            raise SystemExit(1)
+    else:
+        CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        CACHE_FILE.write_text(json.dumps(cache, indent=1))
+        print(f"{len(stale)} locked notebooks rewritten, {len(sources) - len(stale)} unchanged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# Vectorized implementations of the kernels of some exercises, used by benchmark.py to time
+# them on large inputs. They are complete solutions of the exercises, so they are kept here
+# rather than in iam_tools, which the students get together with the notebooks.
+#
+# composition counts the atoms of each element in every structure with a single np.bincount
+# over the concatenated atomic numbers of the dataset, and returns the fractions as a sparse
+# CSR matrix; polynomial builds the powers of the fractions on top of it. With a StructureCache
+# (see iam_tools.structures) the atomic numbers are read from the memory-mapped columns, without
+# building the ase.Atoms objects.
+#
+# The two-body updaters have the same signature as the euler_update and verlet_update functions
+# of the molecular dynamics module, but act on a whole ensemble of systems at once: masses have
+# shape (n_systems,), positions and velocities (n_systems, dim), and dt can be a scalar or one
+# time step per system. simulate_ensemble advances all systems in lockstep, so the Python
+# overhead is paid once per step rather than once per step and per system.
+
+import numpy as np
+
+G = 6.67430e-11  # gravitational constant in SI units
+
+
+def _numbers_and_offsets(structures):
+    if hasattr(structures, "offsets") and hasattr(structures, "numbers"):
+        return np.asarray(structures.numbers), np.asarray(structures.offsets)
+    sizes = [len(structure) for structure in structures]
+    numbers = np.concatenate([structure.numbers for structure in structures]) if sizes else np.zeros(0, dtype=int)
+    return numbers, np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+
+
+def composition(structures, n_elements=100):
+    """
+    Fractional composition of each structure, e.g. [0.5, 0.5] on the columns of H and He for HHe.
+
+    :param structures: a list of ase.Atoms, or a ``StructureCache``
+    :param n_elements: number of columns; column Z holds the fraction of atoms with atomic number Z
+
+    :return: a (n_structures, n_elements) ``scipy.sparse.csr_matrix``
+    """
+    from scipy.sparse import csr_matrix
+
+    numbers, offsets = _numbers_and_offsets(structures)
+    if len(numbers) and numbers.max() >= n_elements:
+        raise ValueError(f"Atomic number {numbers.max()} does not fit in {n_elements} columns")
+    n_structures = len(offsets) - 1
+    sizes = np.diff(offsets)
+    rows = np.repeat(np.arange(n_structures), sizes)
+    counts = np.bincount(rows * n_elements + numbers, minlength=n_structures * n_elements)
+    nonzero = np.flatnonzero(counts)
+    row, column = np.divmod(nonzero, n_elements)
+    indptr = np.searchsorted(row, np.arange(n_structures + 1))
+    return csr_matrix((counts[nonzero] / sizes[row], column, indptr), shape=(n_structures, n_elements))
+
+
+def polynomial(features, nmax):
+    """
+    Entry-wise powers 1 to nmax of a feature matrix, stacked as [X, X**2, ..., X**nmax].
+
+    :param features: a dense or sparse feature matrix, e.g. from ``composition``
+
+    :return: a (n_structures, n_features * nmax) matrix, sparse if features is sparse
+    """
+    from scipy.sparse import hstack, issparse
+
+    if issparse(features):
+        return hstack([features.power(k) for k in range(1, nmax + 1)], format="csr")
+    features = np.asarray(features)
+    return np.hstack([features**k for k in range(1, nmax + 1)])
+
+
+def two_body_forces(m1, m2, r1, r2, k=G):
+    """
+    Gravitational forces acting on the two bodies, for a batch of systems.
+
+    :param m1, m2: masses, shape (n_systems,)
+    :param r1, r2: positions, shape (n_systems, dim)
+    :param k: gravitational constant
+
+    :return: f1, f2, each with shape (n_systems, dim)
+    """
+    delta = r2 - r1
+    norm = np.sqrt(np.sum(delta**2, axis=-1, keepdims=True))
+    f1 = delta * _column(k * np.asarray(m1) * m2) / norm**3
+    return f1, -f1
+
+
+def _column(x):
+    return np.asarray(x, dtype=float)[..., np.newaxis]
+
+
+def euler_update_batch(m1, m2, r1, r2, v1, v2, dt):
+    """
+    Forward Euler step for a batch of two-body systems.
+
+    :return: (r1_new, r2_new, v1_new, v2_new)
+    """
+    f1, f2 = two_body_forces(m1, m2, r1, r2)
+    dt = _column(dt)
+    return (
+        r1 + v1 * dt,
+        r2 + v2 * dt,
+        v1 + f1 / _column(m1) * dt,
+        v2 + f2 / _column(m2) * dt,
+    )
+
+
+def verlet_update_batch(m1, m2, r1, r2, v1, v2, dt):
+    """
+    Velocity Verlet step for a batch of two-body systems.
+
+    :return: (r1_new, r2_new, v1_new, v2_new)
+    """
+    m1_col, m2_col, dt = _column(m1), _column(m2), _column(dt)
+    f1, f2 = two_body_forces(m1, m2, r1, r2)
+    v1_mid = v1 + 0.5 * f1 / m1_col * dt
+    v2_mid = v2 + 0.5 * f2 / m2_col * dt
+    r1_new = r1 + v1_mid * dt
+    r2_new = r2 + v2_mid * dt
+    f1, f2 = two_body_forces(m1, m2, r1_new, r2_new)
+    return r1_new, r2_new, v1_mid + 0.5 * f1 / m1_col * dt, v2_mid + 0.5 * f2 / m2_col * dt
+
+
+def simulate_ensemble(updater, m1, m2, x1_initial, x2_initial, v1_initial, v2_initial, dt, num, stride=1):
+    """
+    Integrates an ensemble of two-body systems, storing the trajectory in preallocated arrays.
+
+    :param updater: a batched updater, such as ``verlet_update_batch``
+    :param m1, m2: masses, scalars or arrays of shape (n_systems,)
+    :param x1_initial, x2_initial, v1_initial, v2_initial: initial conditions, shape (n_systems, dim)
+    :param dt: time step, a scalar or an array of shape (n_systems,)
+    :param num: number of steps
+    :param stride: only one every stride steps is stored
+
+    :return: (x1_log, x2_log, v1_log, v2_log), each with shape (num // stride + 1, n_systems, dim)
+    """
+    x1, x2 = np.array(x1_initial, dtype=float), np.array(x2_initial, dtype=float)
+    v1, v2 = np.array(v1_initial, dtype=float), np.array(v2_initial, dtype=float)
+    n_systems = len(x1)
+    m1 = np.broadcast_to(np.asarray(m1, dtype=float), (n_systems,))
+    m2 = np.broadcast_to(np.asarray(m2, dtype=float), (n_systems,))
+    dt = np.broadcast_to(np.asarray(dt, dtype=float), (n_systems,))
+
+    n_stored = num // stride + 1
+    logs = [np.empty((n_stored,) + x1.shape) for _ in range(4)]
+    for log, value in zip(logs, (x1, x2, v1, v2)):
+        log[0] = value
+    for step in range(1, num + 1):
+        x1, x2, v1, v2 = updater(m1, m2, x1, x2, v1, v2, dt)
+        if step % stride == 0:
+            for log, value in zip(logs, (x1, x2, v1, v2)):
+                log[step // stride] = value
+    return tuple(logs)
+
+
+def two_body_energy(m1, m2, x1, x2, v1, v2, k=G):
+    """
+    Total energy of two-body systems, for arrays of any leading shape (e.g. the output
+    of ``simulate_ensemble``).
+    """
+    distance = np.sqrt(np.sum((x2 - x1) ** 2, axis=-1))
+    kinetic = 0.5 * (m1 * np.sum(v1**2, axis=-1) + m2 * np.sum(v2**2, axis=-1))
+    return kinetic - k * m1 * m2 / distance